@@ -0,0 +1,222 @@
+from collections import OrderedDict
+from typing import Callable, Hashable
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from psycopg import AsyncConnection
+
+from .db import (
+    get_connection,
+    get_conninfo,
+    DatabaseTables,
+    data_update_channel
+)
+
+data_version_ttl = float(os.getenv("DATA_VERSION_TTL", "60"))
+polygon_cache_max_bytes = int(os.getenv("POLYGON_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+compressed_cache_max_bytes = int(os.getenv("COMPRESSED_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+polygon_key_precision = int(os.getenv("POLYGON_KEY_PRECISION", "6"))
+
+
+class LRUCache:
+    """
+    Cache odpowiedzi (bajtów) ograniczony sumarycznym rozmiarem, z wypieraniem LRU.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[Hashable, bytes] = OrderedDict()
+
+    def get(self, key: Hashable) -> bytes | None:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+
+class DataVersion:
+    """
+    Wersja danych wyznaczana z najnowszego wiersza tabeli metadanych.
+    Zmiany ogłasza cron przez NOTIFY (patrz listen); bez aktywnego nasłuchu
+    odczyt z bazy jest odświeżany co DATA_VERSION_TTL sekund. Przy zmianie
+    wersji wywoływane są zarejestrowane funkcje (np. czyszczenie cache).
+    """
+    def __init__(self, ttl: float = data_version_ttl):
+        self.ttl = ttl
+        self.value: str | None = None
+        self.checked_at = 0.0
+        self.listening = False
+        self.listeners: list[Callable[[], None]] = []
+
+    def subscribe(self, listener: Callable[[], None]) -> None:
+        self.listeners.append(listener)
+
+    def set(self, value: str | None) -> None:
+        self.checked_at = time.monotonic()
+        if value != self.value:
+            self.value = value
+            for listener in self.listeners:
+                listener()
+
+    async def refresh(self, conn: AsyncConnection) -> None:
+        cur = await conn.execute(f"""
+            SELECT id FROM {DatabaseTables.metadata_table}
+            ORDER BY last_update DESC
+            LIMIT 1
+        """)
+        row = await cur.fetchone()
+        self.set(str(row[0]) if row else "0")
+
+    async def get(self) -> str | None:
+        if self.value is not None and (self.listening or time.monotonic() - self.checked_at < self.ttl):
+            return self.value
+        try:
+            async with get_connection() as conn:
+                await self.refresh(conn)
+        except Exception as e:
+            print(f"Error reading data version: {e}")
+        return self.value
+
+    async def listen(self, channel: str = data_update_channel, retry_delay: float = 5) -> None:
+        """
+        Nasłuchuje na kanale, na który cron wysyła id nowego wiersza metadanych,
+        na osobnym połączeniu spoza puli. Po (ponownym) połączeniu wersja jest
+        odczytywana od razu, żeby nie zgubić zmian z czasu przerwy. Po utracie
+        połączenia get() wraca do odpytywania co TTL, a pętla łączy się ponownie.
+        """
+        while True:
+            try:
+                async with await AsyncConnection.connect(get_conninfo(), autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {channel}")
+                    await self.refresh(conn)
+                    self.listening = True
+                    async for notify in conn.notifies():
+                        self.set(notify.payload)
+            except Exception as e:
+                print(f"Data version listener error: {e}")
+            finally:
+                self.listening = False
+            await asyncio.sleep(retry_delay)
+
+
+class RegionHierarchy:
+    """
+    Hierarchia TERYT (województwo -> powiat -> gmina) trzymana w pamięci
+    i indeksowana kodem nadrzędnej jednostki. Ładowana przy starcie aplikacji,
+    ponownie dopiero po zmianie wersji danych (invalidate).
+    """
+    def __init__(self):
+        self.wojewodztwa: list[dict] = []
+        self.powiaty: dict[str, list[dict]] = {}
+        self.gminy: dict[str, list[dict]] = {}
+        self.loaded = False
+        self.lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        self.loaded = False
+
+    async def load(self) -> None:
+        async with get_connection() as conn:
+            wojewodztwa = await self.fetch_level(conn, DatabaseTables.woj_table)
+            powiaty = await self.fetch_level(conn, DatabaseTables.pow_table, "woj_kod")
+            gminy = await self.fetch_level(conn, DatabaseTables.gmi_table, "pow_kod")
+        self.wojewodztwa = [region for _, region in wojewodztwa]
+        self.powiaty = self.group(powiaty)
+        self.gminy = self.group(gminy)
+        self.loaded = True
+
+    @staticmethod
+    async def fetch_level(conn, table: str, parent_column: str | None = None) -> list[tuple]:
+        parent = parent_column or "NULL"
+        cur = await conn.execute(f"""
+            SELECT {parent}, "JPT_KOD_JE", "JPT_NAZWA_", "area_2180_km2" FROM {table} ORDER BY "JPT_NAZWA_"
+        """)
+        return [
+            (row[0], {"id": row[1], "name": row[2], "area": row[3]})
+            for row in await cur.fetchall()
+        ]
+
+    @staticmethod
+    def group(rows: list[tuple]) -> dict[str, list[dict]]:
+        grouped: dict[str, list[dict]] = {}
+        for parent, region in rows:
+            grouped.setdefault(parent, []).append(region)
+        return grouped
+
+    async def get(self) -> "RegionHierarchy":
+        if not self.loaded:
+            async with self.lock:
+                if not self.loaded:
+                    await self.load()
+        return self
+
+
+def normalize_ring(ring: list, precision: int, clockwise: bool) -> list:
+    points = [tuple(round(float(c), precision) for c in point[:2]) for point in ring]
+    deduplicated = [p for i, p in enumerate(points) if i == 0 or p != points[i - 1]]
+    if len(deduplicated) > 1 and deduplicated[0] == deduplicated[-1]:
+        deduplicated.pop()
+    if not deduplicated:
+        return []
+
+    area = sum(
+        x1 * y2 - x2 * y1
+        for (x1, y1), (x2, y2) in zip(deduplicated, deduplicated[1:] + deduplicated[:1])
+    )
+    if (area < 0) != clockwise:
+        deduplicated.reverse()
+
+    start = deduplicated.index(min(deduplicated))
+    return deduplicated[start:] + deduplicated[:start]
+
+
+def normalize_polygon(rings: list, precision: int) -> list:
+    exterior, *holes = rings
+    return [normalize_ring(exterior, precision, clockwise=False)] + sorted(
+        normalize_ring(hole, precision, clockwise=True) for hole in holes
+    )
+
+
+def polygon_key(geometry: dict, precision: int = polygon_key_precision) -> str:
+    """
+    Kanoniczny skrót geometrii: zaokrąglone współrzędne, pierścienie bez
+    powtórzonego punktu zamykającego, ustalona orientacja i punkt startowy,
+    posortowane dziury i części multipoligonu.
+    """
+    geometry_type = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+    if geometry_type == "Polygon":
+        canonical = [normalize_polygon(coordinates, precision)]
+    elif geometry_type == "MultiPolygon":
+        canonical = sorted(normalize_polygon(polygon, precision) for polygon in coordinates)
+    else:
+        canonical = geometry
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+data_version = DataVersion()
+polygon_cache = LRUCache(polygon_cache_max_bytes)
+compressed_cache = LRUCache(compressed_cache_max_bytes)
+data_version.subscribe(polygon_cache.clear)
+data_version.subscribe(compressed_cache.clear)
+region_hierarchy = RegionHierarchy()
+data_version.subscribe(region_hierarchy.invalidate)
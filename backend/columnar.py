@@ -0,0 +1,73 @@
+import pyarrow as pa
+
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+PHOTO_ARROW_COLUMNS = """
+    id,
+    ST_X(geometry) AS x,
+    ST_Y(geometry) AS y,
+    rok_wykonania,
+    kolor,
+    charakterystyka_przestrzenna,
+    zrodlo_danych,
+    url_do_pobrania,
+    numer_zgloszenia,
+    dt_pzgik,
+    data_nalotu
+"""
+
+PHOTO_ARROW_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("x", pa.float64()),
+    ("y", pa.float64()),
+    ("rok_wykonania", pa.int32()),
+    ("kolor", pa.dictionary(pa.int32(), pa.string())),
+    ("charakterystyka_przestrzenna", pa.float64()),
+    ("zrodlo_danych", pa.dictionary(pa.int32(), pa.string())),
+    ("url_do_pobrania", pa.string()),
+    ("numer_zgloszenia", pa.string()),
+    ("dt_pzgik", pa.string()),
+    ("data_nalotu", pa.string()),
+])
+
+
+def accepts_arrow(accept: str | None) -> bool:
+    """
+    Czy nagłówek Accept prosi o Arrow: typ Arrow musi być podany jawnie z q > 0
+    i z wagą nie mniejszą niż JSON (application/json, application/*, */*).
+    """
+    if not accept:
+        return False
+    weights = {}
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        media_type = media_type.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[media_type] = q
+
+    arrow_q = weights.get(ARROW_MEDIA_TYPE, 0.0)
+    json_q = weights.get("application/json", weights.get("application/*", weights.get("*/*", 0.0)))
+    return arrow_q > 0 and arrow_q >= json_q
+
+
+def rows_to_record_batch(rows: list[tuple]) -> pa.RecordBatch:
+    """
+    Zamienia paczkę wierszy z PHOTO_ARROW_COLUMNS na kolumnowy RecordBatch.
+    Kolumny kategoryczne (kolor, zrodlo_danych) są kodowane słownikowo.
+    """
+    columns = list(zip(*rows)) if rows else [[] for _ in PHOTO_ARROW_SCHEMA]
+    arrays = []
+    for field, values in zip(PHOTO_ARROW_SCHEMA, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=PHOTO_ARROW_SCHEMA)
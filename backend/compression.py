@@ -0,0 +1,107 @@
+from fastapi import Request
+from fastapi.responses import Response
+from typing import Hashable
+import asyncio
+import gzip
+import os
+
+from .cache import compressed_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+compression_min_size = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+gzip_level = int(os.getenv("GZIP_LEVEL", "6"))
+brotli_quality = int(os.getenv("BROTLI_QUALITY", "5"))
+zstd_level = int(os.getenv("ZSTD_LEVEL", "6"))
+# Większe treści kompresowane są w wątku, żeby nie blokować pętli zdarzeń.
+compression_thread_min_size = int(os.getenv("COMPRESSION_THREAD_MIN_SIZE", "65536"))
+
+# Kolejność preferencji serwera przy równych wagach q w Accept-Encoding.
+SUPPORTED_ENCODINGS = [
+    encoding for encoding, available in (
+        ("zstd", zstandard is not None),
+        ("br", brotli is not None),
+        ("gzip", True)
+    ) if available
+]
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    """
+    Wybiera kodowanie z nagłówka Accept-Encoding: najwyższa waga q,
+    a przy remisie kolejność SUPPORTED_ENCODINGS. None oznacza brak kompresji.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=zstd_level).compress(body)
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=gzip_level)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+async def compressed_response(
+    request: Request,
+    body: bytes,
+    media_type: str,
+    cache_key: Hashable | None = None,
+    headers: dict | None = None
+) -> Response:
+    """
+    Zwraca odpowiedź skompresowaną wynegocjowanym kodowaniem. Przy podanym
+    cache_key skompresowana treść jest zapamiętywana dla pary (klucz, kodowanie),
+    więc kolejne żądania nie kompresują jej ponownie. Treści od
+    compression_thread_min_size bajtów kompresowane są w osobnym wątku.
+    """
+    headers = dict(headers or {})
+    vary = headers.get("Vary")
+    headers["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding is None or len(body) < compression_min_size:
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    compressed = compressed_cache.get((cache_key, encoding)) if cache_key else None
+    if compressed is None:
+        if len(body) >= compression_thread_min_size:
+            compressed = await asyncio.to_thread(compress, body, encoding)
+        else:
+            compressed = compress(body, encoding)
+        if cache_key:
+            compressed_cache.put((cache_key, encoding), compressed)
+
+    headers["Content-Encoding"] = encoding
+    return Response(content=compressed, media_type=media_type, headers=headers)
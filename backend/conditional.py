@@ -0,0 +1,85 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import hashlib
+import os
+
+from .cache import data_version
+
+http_cache_max_age = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))
+
+# Nagłówki, od których zależy reprezentacja odpowiedzi (Arrow vs JSON).
+ETAG_VARY_HEADERS = ("accept",)
+
+
+def make_etag(*parts) -> str:
+    """
+    Słaby ETag (W/"...") ze skrótu podanych części. Słaby, bo ta sama
+    reprezentacja może być wysłana w różnych kodowaniach (gzip / br / zstd).
+    """
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={http_cache_max_age}"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+class ConditionalGetMiddleware:
+    """
+    Obsługa warunkowych GET dla endpointów zależnych wyłącznie od danych w bazie.
+    ETag wyznaczany jest z wersji danych (najnowszy wiersz metadanych), ścieżki
+    i parametrów zapytania, więc zgodny If-None-Match kończy się odpowiedzią 304
+    bez zapytań do bazy poza odczytem wersji.
+    """
+    def __init__(self, app: ASGIApp, prefixes: tuple[str, ...] = ("/api/",)) -> None:
+        self.app = app
+        self.prefixes = prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or not scope["path"].startswith(self.prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        version = await data_version.get()
+        if version is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        etag = make_etag(
+            version,
+            scope["path"],
+            sorted(scope["query_string"].decode("latin-1").split("&")),
+            *(headers.get(name, "") for name in ETAG_VARY_HEADERS)
+        )
+        if etag_matches(headers.get("if-none-match"), etag):
+            await not_modified(etag)(scope, receive, send)
+            return
+
+        async def send_with_etag(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                response_headers = MutableHeaders(scope=message)
+                response_headers.update(cache_headers(etag))
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
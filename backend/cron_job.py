@@ -4,10 +4,13 @@ This script calls the database update function and conditionally runs tile gener
 """
 import sys
 import os
+import shutil
 from dotenv import load_dotenv
 
 from backend.data.fetch_and_save import main as fetch_and_save_data
-from backend.tiling.generate_tiles import MVTGenerator
+from backend.data.models import IngestResult
+from backend.tiling.generate_tiles import MVTGenerator, tile_writer, tiles_clustering
+from backend.tiling.tile_store import tiles_format, mbtiles_name
 
 load_dotenv()
 dbname = os.getenv("POSTGRES_DB")
@@ -19,9 +22,20 @@ photo_table = os.getenv("PHOTO_TABLE", "zdjecia_lotnicze")
 tiles_output_dir = os.getenv("TILES_OUTPUT_DIR", "tiles")
 tiles_min_zoom = int(os.getenv("TILES_MIN_ZOOM", "3"))
 tiles_max_zoom = int(os.getenv("TILES_MAX_ZOOM", "12"))
+tiles_workers = int(os.getenv("TILES_WORKERS", "1"))
+tiles_full_rebuild = os.getenv("TILES_FULL_REBUILD", "false").lower() in ("1", "true", "yes")
 
 
-def generate_tiles():
+def can_update_incrementally(changes: IngestResult | None) -> bool:
+    """Przyrostowo można tylko uzupełnić istniejący zestaw kafli, gdy zmiany pokrywają TILES_MAX_ZOOM."""
+    if changes is None or tiles_full_rebuild or changes.tile_zoom < tiles_max_zoom:
+        return False
+    if tiles_format == "mbtiles":
+        return os.path.exists(os.path.join(tiles_output_dir, mbtiles_name))
+    return os.path.exists(os.path.join(tiles_output_dir, "stats.json"))
+
+
+def generate_tiles(changes: IngestResult | None = None):
     print("\nStarting tile generation...")
     
     db_config = {
@@ -38,36 +52,64 @@ def generate_tiles():
         geom_column="geometry"
     )
     
-    tiles = generator.generate_tiles_for_extent(
-        zoom_min=tiles_min_zoom,
-        zoom_max=tiles_max_zoom
-    )
-    
-    tile_count = 0
-    for z, x, y, tile_bytes in tiles:
-        folder = f"{tiles_output_dir}/{z}/{x}"
-        os.makedirs(folder, exist_ok=True)
-        filename = f"{folder}/{y}.pbf"
-        with open(filename, "wb") as f:
-            f.write(tile_bytes)
-        tile_count += 1
-        if tile_count % 100 == 0:
-            print(f"Generated {tile_count} tiles...")
+    if tiles_clustering == "grid":
+        # od zoomu 0: kafle poniżej TILES_MIN_ZOOM renderuje API na żądanie (grube poziomy są małe)
+        generator.build_cluster_pyramid(zoom_min=0, zoom_max=tiles_max_zoom - 1)
+
+    incremental = can_update_incrementally(changes)
+    writer = tile_writer(tiles_output_dir, update=incremental, bounds=generator.get_extent())
+    try:
+        if incremental:
+            tile_count = generator.update_tiles(
+                writer,
+                changes.changed_tiles,
+                changes.tile_zoom,
+                zoom_min=tiles_min_zoom,
+                zoom_max=tiles_max_zoom,
+                workers=tiles_workers
+            )
+        else:
+            tile_count = generator.write_tiles(
+                writer,
+                zoom_min=tiles_min_zoom,
+                zoom_max=tiles_max_zoom,
+                workers=tiles_workers
+            )
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
     
     generator.save_stats(f"{tiles_output_dir}/stats.json")
     print(f"Tile generation completed. Total tiles: {tile_count}")
 
+    remove_on_demand_tiles()
+
+
+def remove_on_demand_tiles():
+    """
+    Usuwa kafle spoza zakresu TILES_MIN_ZOOM-TILES_MAX_ZOOM wyrenderowane przez
+    API na żądanie (TILES_ON_DEMAND) ze starych danych; API wyrenderuje je
+    ponownie przy pierwszym żądaniu.
+    """
+    if not os.path.isdir(tiles_output_dir):
+        return
+    for entry in os.listdir(tiles_output_dir):
+        if entry.isdigit() and not tiles_min_zoom <= int(entry) <= tiles_max_zoom:
+            shutil.rmtree(os.path.join(tiles_output_dir, entry), ignore_errors=True)
+            print(f"Removed on-demand tiles for zoom {entry}")
+
 if __name__ == "__main__":
     print("Starting database update...")
     try:
-        new_records = fetch_and_save_data()
-        print(f"Database update completed successfully. New records: {new_records}")
+        result = fetch_and_save_data()
+        print(f"Database update completed successfully. New records: {result.new_records}")
         
-        if new_records > 0:
-            print(f"Detected {new_records} new records. Regenerating tiles...")
-            generate_tiles()
+        if result.changed_tiles:
+            print(f"Detected changes in {len(result.changed_tiles)} tiles at zoom {result.tile_zoom}. Regenerating tiles...")
+            generate_tiles(result)
         else:
-            print("No new records detected. Skipping tile generation.")
+            print("No changed records detected. Skipping tile generation.")
             
     except Exception as e:
         print(f"Error in cron job: {e}")
@@ -14,7 +14,7 @@ from .process.transform import (
     hash_attributes_vectorized
 )
 from .save.save_to_postgres import PostgresSaver
-from .models import PolandBbox2180
+from .models import PolandBbox2180, IngestResult
 
 load_dotenv()
 dbname = os.getenv("POSTGRES_DB")
@@ -24,6 +24,15 @@ host = os.getenv("POSTGRES_HOST", "localhost")
 port = int(os.getenv("POSTGRES_PORT", "5432"))
 photo_table = os.getenv("PHOTO_TABLE", "zdjecia_lotnicze")
 metadata_table = os.getenv("METADATA_TABLE", "metadane")
+woj_table = os.getenv("WOJEWODZTWA_TABLE", "wojewodztwa")
+pow_table = os.getenv("POWIATY_TABLE", "powiaty")
+gmi_table = os.getenv("GMINY_TABLE", "gminy")
+region_stats_table = os.getenv("REGION_STATS_TABLE", "region_stats")
+tiles_max_zoom = int(os.getenv("TILES_MAX_ZOOM", "12"))
+data_update_channel = os.getenv("DATA_UPDATE_CHANNEL", "metadane_update")
+region_simplify_tolerances = [
+    float(t) for t in os.getenv("REGION_SIMPLIFY_TOLERANCES", "0.0001,0.001,0.01").split(",")
+]
 
 # python -m backend.data.fetch_and_save
 
@@ -41,7 +50,7 @@ def fetch_bbox_parallel(
         print(f"Error fetching bbox {bbox}: {e}")
     return None
 
-def main():
+def main() -> IngestResult:
     wfs_url = "https://mapy.geoportal.gov.pl/wss/service/PZGIK/ZDJ/WFS/Skorowidze_Srodki_Rzutow_Zdjec"
     db_url = f"postgresql://{user}:{password}@{host}:{port}/{dbname}"
 
@@ -51,7 +60,7 @@ def main():
         retry_delay=2,
         timeout=500
     )
-    saver = PostgresSaver(db_url)
+    saver = PostgresSaver(db_url, tile_zoom=tiles_max_zoom)
 
     with saver.engine.begin() as conn:
 
@@ -71,10 +80,20 @@ def main():
                 url_do_pobrania TEXT,
                 dt_pzgik TEXT,
                 uid TEXT,
-                geometry geometry
+                geometry geometry,
+                woj_kod TEXT,
+                pow_kod TEXT,
+                gmi_kod TEXT
             );
         """))
 
+        conn.execute(text(f"""
+            ALTER TABLE {photo_table}
+                ADD COLUMN IF NOT EXISTS woj_kod TEXT,
+                ADD COLUMN IF NOT EXISTS pow_kod TEXT,
+                ADD COLUMN IF NOT EXISTS gmi_kod TEXT;
+        """))
+
         conn.execute(text(f"""
             DO $$
             BEGIN
@@ -168,6 +187,45 @@ def main():
                 END IF;
             END$$;
         """))
+
+        conn.execute(text(f"""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1
+                    FROM pg_indexes
+                    WHERE tablename = '{photo_table}' AND indexname = '{photo_table}_woj_kod_idx'
+                ) THEN
+                    CREATE INDEX {photo_table}_woj_kod_idx ON {photo_table} (woj_kod, id);
+                END IF;
+            END$$;
+        """))
+
+        conn.execute(text(f"""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1
+                    FROM pg_indexes
+                    WHERE tablename = '{photo_table}' AND indexname = '{photo_table}_pow_kod_idx'
+                ) THEN
+                    CREATE INDEX {photo_table}_pow_kod_idx ON {photo_table} (pow_kod, id);
+                END IF;
+            END$$;
+        """))
+
+        conn.execute(text(f"""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1
+                    FROM pg_indexes
+                    WHERE tablename = '{photo_table}' AND indexname = '{photo_table}_gmi_kod_idx'
+                ) THEN
+                    CREATE INDEX {photo_table}_gmi_kod_idx ON {photo_table} (gmi_kod, id);
+                END IF;
+            END$$;
+        """))
         
     layers = fetcher.get_layers()
     new_records_count = 0
@@ -374,13 +432,36 @@ def main():
         else:
             print(f"No data found for layer {layer}")
 
+    # _subdivided potrzebne jest tylko dla gmin (assign_regions); usuwamy tabele
+    # województw i powiatów zbudowane przez wcześniejsze wersje
+    saver.drop_tables([f"{woj_table}_subdivided", f"{pow_table}_subdivided"])
+    rebuilt_regions = saver.refresh_subdivided_regions([gmi_table])
+    saver.refresh_simplified_regions([woj_table, pow_table, gmi_table], region_simplify_tolerances)
+
+    saver.assign_regions(
+        table_name=photo_table,
+        gmi_table=gmi_table,
+        pow_table=pow_table,
+        reassign=gmi_table in rebuilt_regions
+    )
+
+    saver.refresh_region_stats(
+        table_name=photo_table,
+        stats_table=region_stats_table
+    )
+
     saver.update_metadata_table(
         table_name=photo_table,
         new_count=new_records_count,
-        metadata_table=metadata_table
+        metadata_table=metadata_table,
+        notify_channel=data_update_channel
     )
     
-    return new_records_count
+    return IngestResult(
+        new_records=new_records_count,
+        changed_tiles=saver.changed_tiles,
+        tile_zoom=saver.tile_zoom
+    )
 
 if __name__ == "__main__":
     main()
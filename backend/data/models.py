@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 @dataclass
 class PolandBbox2180:
@@ -35,4 +35,15 @@ class PolandBbox2180:
         else:
             return default_step
 
-    
\ No newline at end of file
+    
+
+
+@dataclass
+class IngestResult:
+    """
+    Wynik importu: liczba nowych rekordów oraz kafle (x, y) na zoomie tile_zoom,
+    w których dodano lub usunięto zdjęcia.
+    """
+    new_records: int = 0
+    changed_tiles: set[tuple[int, int]] = field(default_factory=set)
+    tile_zoom: int = 12
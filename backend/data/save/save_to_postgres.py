@@ -1,11 +1,28 @@
 
 import geopandas as gpd
+import json
 from datetime import datetime
 from sqlalchemy import create_engine, text
 from sqlalchemy.types import Text, Integer, DOUBLE_PRECISION, BIGINT
 
+from ...stats import stats_query, build_grouped_stats
+
+def tile_xy_sql(geom: str, zoom: int) -> str:
+    """Kolumny x, y kafla XYZ (Web Mercator) na danym zoomie dla punktu w EPSG:4326."""
+    return f"""
+        CAST(floor((ST_X({geom}) + 180) / 360 * {2 ** zoom}) AS INTEGER) AS x,
+        CAST(floor(
+            (1 - ln(tan(radians(ST_Y({geom}))) + 1 / cos(radians(ST_Y({geom})))) / pi()) / 2 * {2 ** zoom}
+        ) AS INTEGER) AS y
+    """
+
+
 class PostgresSaver:
-    def __init__(self, db_url):
+    def __init__(self, db_url, tile_zoom: int = 12):
+        # Kafle (x, y) na zoomie tile_zoom, w których od utworzenia obiektu
+        # dodano lub usunięto zdjęcia; na ich podstawie regenerowane są kafle.
+        self.tile_zoom = tile_zoom
+        self.changed_tiles: set[tuple[int, int]] = set()
         self.engine = create_engine(
             db_url,
             pool_size=10,
@@ -18,6 +35,17 @@ class PostgresSaver:
             }
         )
     
+    def record_changed_tiles(self, result) -> int:
+        """
+        Zapamiętuje kafle z wyniku zapytania (x, y, liczba zdjęć) i zwraca
+        łączną liczbę zmienionych rekordów.
+        """
+        changed_count = 0
+        for x, y, count in result:
+            self.changed_tiles.add((x, y))
+            changed_count += count
+        return changed_count
+
     def count_records_in_db(self, table_name: str, year_start: int, year_end: int) -> int:
         """
         Zlicza rekordy w bazie dla zakresu lat.
@@ -41,11 +69,19 @@ class PostgresSaver:
         """
         try:
             with self.engine.begin() as conn:
-                result = conn.execute(
-                    text(f"DELETE FROM {table_name} WHERE rok_wykonania BETWEEN :year_start AND :year_end"),
+                deleted_count = self.record_changed_tiles(conn.execute(
+                    text(f"""
+                        WITH deleted AS (
+                            DELETE FROM {table_name}
+                            WHERE rok_wykonania BETWEEN :year_start AND :year_end
+                            RETURNING geometry
+                        )
+                        SELECT {tile_xy_sql("geometry", self.tile_zoom)}, COUNT(*)
+                        FROM deleted
+                        GROUP BY 1, 2
+                    """),
                     {"year_start": year_start, "year_end": year_end}
-                )
-                deleted_count = result.rowcount
+                ))
                 print(f"  Deleted {deleted_count:,} records for years {year_start}-{year_end}")
                 return deleted_count
         except Exception as e:
@@ -89,14 +125,18 @@ class PostgresSaver:
             columns = [col for col in gdf_columns if col != 'geometry']
             columns_str = ", ".join(columns)
             
-            result = conn.execute(text(f"""
-                INSERT INTO {table_name} ({columns_str}, geometry)
-                SELECT {columns_str}, geometry
-                FROM {temp_table}
-                ON CONFLICT (uid) DO NOTHING;
-            """))
-            
-            inserted_records = result.rowcount
+            inserted_records = self.record_changed_tiles(conn.execute(text(f"""
+                WITH inserted AS (
+                    INSERT INTO {table_name} ({columns_str}, geometry)
+                    SELECT {columns_str}, geometry
+                    FROM {temp_table}
+                    ON CONFLICT (uid) DO NOTHING
+                    RETURNING geometry
+                )
+                SELECT {tile_xy_sql("geometry", self.tile_zoom)}, COUNT(*)
+                FROM inserted
+                GROUP BY 1, 2
+            """)))
             duplicate_records = total_records - inserted_records
             
             if duplicate_records > 0:
@@ -105,11 +145,211 @@ class PostgresSaver:
             conn.execute(text(f"DROP TABLE {temp_table}"))
         return inserted_records
             
+    @staticmethod
+    def region_fingerprint(conn, table_name: str, params: str = "") -> str:
+        """
+        Skrót md5 kodów i skrótów geometrii regionów (oraz parametrów przeliczenia),
+        zmieniający się przy każdej zmianie granic, także przy tych samych kodach.
+        """
+        return conn.execute(text(f"""
+            SELECT md5(
+                :params || string_agg(
+                    "JPT_KOD_JE" || ':' || md5(ST_AsEWKB(geometry)), ','
+                    ORDER BY "JPT_KOD_JE"
+                )
+            )
+            FROM {table_name}
+        """), {"params": params}).scalar() or ""
+
+    @staticmethod
+    def derived_table_current(conn, derived_table: str, fingerprint: str) -> bool:
+        """Czy tabela pochodna została zbudowana ze źródła o podanym skrócie (COMMENT ON TABLE)"""
+        stored = conn.execute(
+            text("SELECT obj_description(CAST(:table AS regclass), 'pg_class')"),
+            {"table": derived_table}
+        ).scalar()
+        return stored == fingerprint
+
+    def drop_tables(self, tables: list[str]) -> None:
+        with self.engine.begin() as conn:
+            for table in tables:
+                conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+    def refresh_subdivided_regions(
+        self,
+        region_tables: list[str],
+        max_vertices: int = 256
+    ) -> list[str]:
+        """
+        Utrzymuje tabele {tabela}_subdivided z granicami regionów pociętymi przez
+        ST_Subdivide na fragmenty o co najwyżej max_vertices wierzchołkach, z własnym
+        indeksem GiST. Małe fragmenty mają ciasne prostokąty ograniczające, więc
+        ST_Intersects z punktami zdjęć korzysta z indeksu zamiast testować cały poligon.
+        Tabela jest przebudowywana, gdy zmieniły się kody lub granice regionów
+        w tabeli źródłowej (skrót z region_fingerprint zapisany w komentarzu tabeli).
+        Zwraca tabele źródłowe, dla których tabela _subdivided została przebudowana.
+        """
+        rebuilt = []
+        for table_name in region_tables:
+            subdivided_table = f"{table_name}_subdivided"
+            with self.engine.begin() as conn:
+                conn.execute(text(f"""
+                    CREATE TABLE IF NOT EXISTS {subdivided_table} (
+                        jpt_kod TEXT NOT NULL,
+                        geometry geometry
+                    );
+                """))
+                conn.execute(text(f"""
+                    CREATE INDEX IF NOT EXISTS {subdivided_table}_geometry_idx
+                    ON {subdivided_table} USING GIST (geometry);
+                """))
+                conn.execute(text(f"""
+                    CREATE INDEX IF NOT EXISTS {subdivided_table}_jpt_kod_idx
+                    ON {subdivided_table} (jpt_kod);
+                """))
+
+                fingerprint = self.region_fingerprint(conn, table_name, f"subdivide={max_vertices}")
+                if self.derived_table_current(conn, subdivided_table, fingerprint):
+                    continue
+
+                conn.execute(text(f"TRUNCATE {subdivided_table}"))
+                result = conn.execute(text(f"""
+                    INSERT INTO {subdivided_table} (jpt_kod, geometry)
+                    SELECT "JPT_KOD_JE", ST_Subdivide(geometry, :max_vertices)
+                    FROM {table_name}
+                """), {"max_vertices": max_vertices})
+                conn.execute(text(f"COMMENT ON TABLE {subdivided_table} IS '{fingerprint}'"))
+                conn.execute(text(f"ANALYZE {subdivided_table}"))
+                print(f"Rebuilt {subdivided_table}: {result.rowcount:,} pieces")
+                rebuilt.append(table_name)
+        return rebuilt
+
+    def refresh_simplified_regions(
+        self,
+        region_tables: list[str],
+        tolerances: list[float]
+    ) -> None:
+        """
+        Utrzymuje tabele {tabela}_simplified z uproszczonymi granicami regionów
+        (ST_SimplifyPreserveTopology) dla każdej tolerancji w stopniach.
+        Pełna geometria zostaje w tabeli źródłowej. Tabela jest przebudowywana,
+        gdy zmieniły się kody lub granice regionów albo lista tolerancji.
+        """
+        for table_name in region_tables:
+            simplified_table = f"{table_name}_simplified"
+            with self.engine.begin() as conn:
+                conn.execute(text(f"""
+                    CREATE TABLE IF NOT EXISTS {simplified_table} (
+                        jpt_kod TEXT NOT NULL,
+                        tolerance DOUBLE PRECISION NOT NULL,
+                        geometry geometry,
+                        PRIMARY KEY (jpt_kod, tolerance)
+                    );
+                """))
+
+                fingerprint = self.region_fingerprint(
+                    conn, table_name, f"tolerances={sorted(set(tolerances))}"
+                )
+                if self.derived_table_current(conn, simplified_table, fingerprint):
+                    continue
+
+                conn.execute(text(f"TRUNCATE {simplified_table}"))
+                result = conn.execute(text(f"""
+                    INSERT INTO {simplified_table} (jpt_kod, tolerance, geometry)
+                    SELECT r."JPT_KOD_JE", t.tolerance,
+                           ST_SimplifyPreserveTopology(r.geometry, t.tolerance)
+                    FROM {table_name} r
+                    CROSS JOIN unnest(CAST(:tolerances AS DOUBLE PRECISION[])) AS t(tolerance)
+                """), {"tolerances": list(tolerances)})
+                conn.execute(text(f"COMMENT ON TABLE {simplified_table} IS '{fingerprint}'"))
+                print(f"Rebuilt {simplified_table}: {result.rowcount:,} geometries")
+
+    def assign_regions(
+        self,
+        table_name: str,
+        gmi_table: str = "gminy",
+        pow_table: str = "powiaty",
+        reassign: bool = False
+    ) -> int:
+        """
+        Uzupełnia kody gminy, powiatu i województwa dla zdjęć, które ich jeszcze nie mają.
+        Przy reassign=True (granice gmin się zmieniły) kody wszystkich zdjęć są
+        najpierw czyszczone i przypisywane od nowa w tej samej transakcji.
+        Test przestrzenny wykonywany jest na {gmi_table}_subdivided
+        (patrz refresh_subdivided_regions).
+        Zwraca liczbę zaktualizowanych rekordów.
+        """
+        with self.engine.begin() as conn:
+            if reassign:
+                conn.execute(text(f"""
+                    UPDATE {table_name}
+                    SET gmi_kod = NULL, pow_kod = NULL, woj_kod = NULL
+                    WHERE gmi_kod IS NOT NULL OR pow_kod IS NOT NULL OR woj_kod IS NOT NULL
+                """))
+            result = conn.execute(text(f"""
+                UPDATE {table_name} p
+                SET gmi_kod = g."JPT_KOD_JE",
+                    pow_kod = g.pow_kod,
+                    woj_kod = pw.woj_kod
+                FROM {gmi_table}_subdivided s
+                JOIN {gmi_table} g ON g."JPT_KOD_JE" = s.jpt_kod
+                JOIN {pow_table} pw ON pw."JPT_KOD_JE" = g.pow_kod
+                WHERE p.gmi_kod IS NULL
+                AND ST_Intersects(p.geometry, s.geometry)
+            """))
+            assigned_count = result.rowcount
+            print(f"Assigned administrative regions to {assigned_count:,} records")
+            return assigned_count
+
+    def refresh_region_stats(
+        self,
+        table_name: str,
+        stats_table: str = "region_stats"
+    ) -> int:
+        """
+        Przelicza statystyki (struktura stats.json) dla każdego województwa, powiatu
+        i gminy na podstawie kodów przypisanych przez assign_regions i zapisuje je
+        w tabeli {stats_table} z kluczem (level, jpt_kod).
+        Zwraca liczbę zapisanych regionów.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {stats_table} (
+                    level TEXT NOT NULL,
+                    jpt_kod TEXT NOT NULL,
+                    stats JSON NOT NULL,
+                    PRIMARY KEY (level, jpt_kod)
+                );
+            """))
+
+            records = []
+            for level in ("woj", "pow", "gmi"):
+                column = f"{level}_kod"
+                rows = conn.execute(text(
+                    stats_query(table_name, f"{column} IS NOT NULL", group_by=column)
+                )).fetchall()
+                for jpt_kod, stats in build_grouped_stats(rows, keep_missing=True).items():
+                    records.append({
+                        "level": level,
+                        "jpt_kod": jpt_kod,
+                        "stats": json.dumps(stats, ensure_ascii=False, separators=(",", ":"))
+                    })
+
+            conn.execute(text(f"DELETE FROM {stats_table}"))
+            if records:
+                conn.execute(text(f"""
+                    INSERT INTO {stats_table} (level, jpt_kod, stats)
+                    VALUES (:level, :jpt_kod, CAST(:stats AS JSON))
+                """), records)
+            print(f"Region statistics refreshed for {len(records):,} regions")
+            return len(records)
+
     def update_metadata_table(
         self,
         table_name: str,
         new_count: int | None = None,
-        metadata_table: str = "metadane"
+        metadata_table: str = "metadane",
+        notify_channel: str | None = None
     ):
         """
         Aktualizuje tabelę metadanych dla warstwy.
@@ -118,6 +358,8 @@ class PostgresSaver:
             table_name: nazwa tabeli z danymi (np. 'zdjecia_lotnicze')
             new_count: liczba nowych rekordów przy tej aktualizacji
             metadata_table: nazwa tabeli z metadanymi (default 'metadata')
+            notify_channel: kanał NOTIFY, na którym po zatwierdzeniu transakcji
+                ogłaszane jest id nowego wiersza metadanych (nowa wersja danych)
         """
         with self.engine.begin() as conn:
             conn.execute(text(f"""
@@ -148,19 +390,26 @@ class PostgresSaver:
                 FROM final_hull;
             """)).scalar()
 
-            conn.execute(text(f"""
+            metadata_id = conn.execute(text(f"""
                 INSERT INTO {metadata_table} (
                     table_name, records_count, last_update, new_count, convex_hull_area
                 )
                 VALUES (
                     :table_name, :records_count, :last_update, :new_count, :convex_hull_area
                 )
+                RETURNING id
             """), {
                 "table_name": table_name,
                 "records_count": records_count,
                 "last_update": datetime.now(),
                 "new_count": new_count,
                 "convex_hull_area": convex_hull_area
-            })
+            }).scalar()
+
+            if notify_channel:
+                conn.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": notify_channel, "payload": str(metadata_id)}
+                )
 
             print(f"Metadata updated for '{table_name}': {records_count} records, convex hull area {convex_hull_area:.2f} km²")
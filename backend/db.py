@@ -1,6 +1,10 @@
-from psycopg2.pool import SimpleConnectionPool
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from psycopg import AsyncConnection
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+import asyncio
 import os
-import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,6 +18,14 @@ metadata_table = os.getenv("METADATA_TABLE", "metadane")
 woj_table = os.getenv("WOJEWODZTWA_TABLE", "wojewodztwa")
 pow_table = os.getenv("POWIATY_TABLE", "powiaty")
 gmi_table = os.getenv("GMINY_TABLE", "gminy")
+region_stats_table = os.getenv("REGION_STATS_TABLE", "region_stats")
+data_update_channel = os.getenv("DATA_UPDATE_CHANNEL", "metadane_update")
+region_simplify_tolerances = sorted(
+    float(t) for t in os.getenv("REGION_SIMPLIFY_TOLERANCES", "0.0001,0.001,0.01").split(",")
+)
+pool_min_size = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "3"))
+pool_max_size = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10"))
+pool_timeout = float(os.getenv("POSTGRES_POOL_TIMEOUT", "10"))
 
 
 class DatabaseTables:
@@ -22,42 +34,70 @@ class DatabaseTables:
     woj_table = woj_table
     pow_table = pow_table
     gmi_table = gmi_table
+    region_stats_table = region_stats_table
 
-pool = None
+    @classmethod
+    def region_table(cls, level: str) -> str:
+        return {"woj": cls.woj_table, "pow": cls.pow_table, "gmi": cls.gmi_table}[level]
 
+    @classmethod
+    def simplified_table(cls, level: str) -> str:
+        return f"{cls.region_table(level)}_simplified"
 
-def init_pool(
+pool: AsyncConnectionPool | None = None
+
+
+def get_conninfo() -> str:
+    return make_conninfo(
+        dbname=dbname,
+        user=user,
+        password=password,
+        host=host,
+        port=port
+    )
+
+
+async def init_pool(
     max_retries: int = 10,
     retry_delay: int = 2
-) -> SimpleConnectionPool:
+) -> AsyncConnectionPool:
     global pool
     if pool is None:
         for attempt in range(1, max_retries + 1):
+            candidate = AsyncConnectionPool(
+                conninfo=get_conninfo(),
+                min_size=pool_min_size,
+                max_size=pool_max_size,
+                timeout=pool_timeout,
+                open=False
+            )
             try:
-                pool = SimpleConnectionPool(
-                    minconn=3,
-                    maxconn=10,
-                    dbname=dbname,
-                    user=user,
-                    password=password,
-                    host=host,
-                    port=port
-                )
+                await candidate.open(wait=True, timeout=pool_timeout)
+                pool = candidate
                 break
             except Exception as e:
+                await candidate.close()
                 if attempt == max_retries:
                     print(f"Failed to connect to database after {max_retries} attempts: {e}")
                     raise
-                time.sleep(retry_delay)
+                await asyncio.sleep(retry_delay)
     return pool
 
-def get_connection():
-    global pool
-    if pool is None:
-        init_pool()
-    return pool.getconn()
 
-def release_connection(conn):
+async def close_pool() -> None:
     global pool
-    if pool:
-        pool.putconn(conn)
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+@asynccontextmanager
+async def get_connection() -> AsyncIterator[AsyncConnection]:
+    """
+    Wypożycza połączenie z puli na czas bloku `async with`.
+    Gdy pula jest wyczerpana dłużej niż POSTGRES_POOL_TIMEOUT, zgłaszany jest PoolTimeout.
+    """
+    if pool is None:
+        await init_pool()
+    async with pool.connection(timeout=pool_timeout) as conn:
+        yield conn
@@ -0,0 +1,81 @@
+from fastapi import Query
+import json
+
+from .models import AttributeFilters
+
+
+def polygon_filter(polygon: dict | str) -> tuple[str, tuple]:
+    if isinstance(polygon, dict):
+        polygon = json.dumps(polygon)
+    return "ST_Intersects(geometry, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326))", (polygon,)
+
+
+def region_filter(level: str) -> str:
+    """
+    Warunek na kod regionu przypisany zdjęciu przy imporcie (woj_kod / pow_kod / gmi_kod).
+    """
+    if level not in ("woj", "pow", "gmi"):
+        raise ValueError(f"Unknown region level: {level}")
+    return f"{level}_kod = %s"
+
+
+def attribute_filters(
+    rok_od: int | None = None,
+    rok_do: int | None = None,
+    kolor: list[str] | None = Query(None),
+    zrodlo_danych: list[str] | None = Query(None),
+    gsd_min: float | None = Query(None, ge=0),
+    gsd_max: float | None = Query(None, ge=0)
+) -> AttributeFilters:
+    """
+    Zależność FastAPI zbierająca filtry atrybutów z parametrów zapytania GET.
+    """
+    return AttributeFilters(
+        rok_od=rok_od,
+        rok_do=rok_do,
+        kolor=kolor,
+        zrodlo_danych=zrodlo_danych,
+        gsd_min=gsd_min,
+        gsd_max=gsd_max
+    )
+
+
+def attribute_filter(filters: AttributeFilters) -> tuple[str, tuple]:
+    """
+    Kompiluje filtry atrybutów do warunku WHERE, tak by trafiały w indeksy
+    na rok_wykonania, kolor, zrodlo_danych i charakterystyka_przestrzenna.
+    """
+    clauses = []
+    params = []
+    if filters.rok_od is not None:
+        clauses.append("rok_wykonania >= %s")
+        params.append(filters.rok_od)
+    if filters.rok_do is not None:
+        clauses.append("rok_wykonania <= %s")
+        params.append(filters.rok_do)
+    if filters.kolor:
+        clauses.append("kolor = ANY(%s)")
+        params.append(list(filters.kolor))
+    if filters.zrodlo_danych:
+        clauses.append("zrodlo_danych = ANY(%s)")
+        params.append(list(filters.zrodlo_danych))
+    if filters.gsd_min is not None:
+        clauses.append("charakterystyka_przestrzenna >= %s")
+        params.append(filters.gsd_min)
+    if filters.gsd_max is not None:
+        clauses.append("charakterystyka_przestrzenna <= %s")
+        params.append(filters.gsd_max)
+    return " AND ".join(clauses) or "TRUE", tuple(params)
+
+
+def filtered(where: str, params: tuple, filters: AttributeFilters) -> tuple[str, tuple]:
+    attribute_where, attribute_params = attribute_filter(filters)
+    return f"{where} AND {attribute_where}", params + attribute_params
+
+
+def filters_key(filters: AttributeFilters) -> tuple:
+    values = filters.model_dump(include=set(AttributeFilters.model_fields), exclude_none=True)
+    return tuple(
+        (name, tuple(sorted(value)) if isinstance(value, list) else value)
+        for name, value in sorted(values.items())
+    )
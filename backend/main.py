@@ -1,9 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from psycopg_pool import PoolTimeout
+import asyncio
 
-from .db import init_pool
+from .db import init_pool, close_pool
+from .cache import data_version, region_hierarchy
+from .compression import compression_min_size
+from .conditional import ConditionalGetMiddleware
 from .routers import (
     db_metadata,
+    photo_count,
+    photo_stats,
     photos,
     regions,
     report,
@@ -15,6 +24,13 @@ from .routers import (
 
 app = FastAPI()
 
+# Middleware dodane później jest zewnętrzne: CORS -> GZip -> ConditionalGet -> endpointy.
+app.add_middleware(ConditionalGetMiddleware)
+
+# Odpowiedzi spoza cache (strumienie, listy regionów) kompresuje gzip w locie;
+# odpowiedzi z ustawionym już Content-Encoding middleware przepuszcza bez zmian.
+app.add_middleware(GZipMiddleware, minimum_size=compression_min_size)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -24,11 +40,30 @@ app.add_middleware(
 )
 
 @app.on_event("startup")
-def startup_event():
-    init_pool()
+async def startup_event():
+    await init_pool()
+    await data_version.get()
+    app.state.data_version_listener = asyncio.create_task(data_version.listen())
+    try:
+        await region_hierarchy.load()
+    except Exception as e:
+        print(f"Error loading region hierarchy: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.data_version_listener.cancel()
+    await close_pool()
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"error": "Database busy, try again later"})
 
 
 app.include_router(photos.router)
+app.include_router(photo_count.router)
+app.include_router(photo_stats.router)
 app.include_router(regions.router)
 app.include_router(report.router)
 app.include_router(tiles.router)
@@ -1,13 +1,35 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, TypedDict
+from typing import Optional, Dict, Any, List, Literal, TypedDict
+import os
 
 
 limit = 500000
+# Liczba miejsc po przecinku we współrzędnych GeoJSON (5 ≈ 1 m, tak jak zaokrągla import).
+precision = int(os.getenv("GEOJSON_PRECISION", "5"))
 
-class PolygonModel(BaseModel):
+class AttributeFilters(BaseModel):
+    rok_od: Optional[int] = None
+    rok_do: Optional[int] = None
+    kolor: Optional[List[str]] = None
+    zrodlo_danych: Optional[List[str]] = None
+    gsd_min: Optional[float] = Field(default=None, ge=0)
+    gsd_max: Optional[float] = Field(default=None, ge=0)
+
+
+class SelectionModel(AttributeFilters):
     polygon: dict
-    skip: int = Field(default=0, ge=0)
+
+
+class CountModel(SelectionModel):
+    mode: Literal["estimate", "exact"] = "estimate"
+
+
+class PolygonModel(SelectionModel):
+    cursor: Optional[str] = None
     limit: int = Field(default=limit, ge=1)
+    precision: int = Field(default=precision, ge=0, le=15)
+    stream: bool = False
+    format: Literal["geojson", "ndjson"] = "geojson"
 
 
 class FeatureProperties(BaseModel):
@@ -33,6 +55,7 @@ class RegionProperties(BaseModel):
     kod: str
     nazwa: str
     area: float
+    tolerance: Optional[float] = None  # tolerancja uproszczenia granicy w stopniach, None = pełna geometria
     
     
 class Region(BaseModel):
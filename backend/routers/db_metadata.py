@@ -1,29 +1,35 @@
 from fastapi import APIRouter, HTTPException
+from psycopg_pool import PoolTimeout
 from datetime import datetime
 
 from ..models import Metadata
 from ..db import (
     get_connection,
-    release_connection,
     DatabaseTables
 )
+from ..cache import data_version
 
 router = APIRouter()
 
+# Najnowszy wiersz metadanych; czyszczony przy zmianie wersji danych (NOTIFY z crona).
+metadata_cache: dict[str, Metadata] = {}
+data_version.subscribe(metadata_cache.clear)
+
 @router.get("/api/metadane")
-def get_metadata() -> Metadata:
+async def get_metadata() -> Metadata:
+    await data_version.get()
+    if "latest" in metadata_cache:
+        return metadata_cache["latest"]
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        cur.execute(f"""
-            SELECT records_count, to_char(last_update, 'YYYY-MM-DD HH24:MI:SS') AS last_update, convex_hull_area 
-            FROM {DatabaseTables.metadata_table}
-            ORDER BY last_update DESC
-            LIMIT 1
-        """)
-        
-        row = cur.fetchone()
+        async with get_connection() as conn:
+            cur = await conn.execute(f"""
+                SELECT records_count, to_char(last_update, 'YYYY-MM-DD HH24:MI:SS') AS last_update, convex_hull_area 
+                FROM {DatabaseTables.metadata_table}
+                ORDER BY last_update DESC
+                LIMIT 1
+            """)
+
+            row = await cur.fetchone()
         
         if row is None:
             raise HTTPException(status_code=404, detail="No metadata found")
@@ -36,13 +42,10 @@ def get_metadata() -> Metadata:
             convex_hull_area_km2=convex_hull_area
         )
 
+        metadata_cache["latest"] = metadata
         return metadata
         
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching metadata: {str(e)}")
-    
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            release_connection(conn)
@@ -0,0 +1,118 @@
+from fastapi.responses import JSONResponse, Response
+from fastapi import APIRouter, Depends, Query, Request
+from psycopg_pool import PoolTimeout
+from psycopg import AsyncClientCursor
+import json
+
+from ..models import AttributeFilters, CountModel
+from ..db import (
+    get_connection,
+    DatabaseTables
+)
+from ..filters import (
+    polygon_filter,
+    region_filter,
+    attribute_filters,
+    filtered,
+    filters_key
+)
+from ..compression import compressed_response
+from ..cache import (
+    data_version,
+    polygon_cache,
+    polygon_key
+)
+
+router = APIRouter()
+
+
+async def estimate_count(conn, where: str, params: tuple) -> int:
+    """
+    Liczba wierszy szacowana przez planer (EXPLAIN, bez wykonywania zapytania).
+    Kursor po stronie klienta wstawia parametry jako literały, więc planer
+    korzysta ze statystyk dla konkretnych wartości (kod regionu, poligon).
+    """
+    async with AsyncClientCursor(conn) as cur:
+        await cur.execute(
+            f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {DatabaseTables.photo_table} WHERE {where}", params
+        )
+        plan = (await cur.fetchone())[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def exact_count(conn, where: str, params: tuple) -> int:
+    """
+    Dokładna liczba wierszy. Dla samego kodu regionu planer może użyć
+    index-only scan po indeksie ({poziom}_kod, id).
+    """
+    cur = await conn.execute(f"SELECT COUNT(*) FROM {DatabaseTables.photo_table} WHERE {where}", params)
+    return (await cur.fetchone())[0]
+
+
+async def selection_count(
+    request: Request,
+    where: str,
+    params: tuple,
+    filters: AttributeFilters,
+    mode: str,
+    cache_key: tuple | None
+) -> Response:
+    where, params = filtered(where, params, filters)
+    if cache_key:
+        cache_key = cache_key + (mode, filters_key(filters))
+
+    cached = polygon_cache.get(cache_key) if cache_key else None
+    if cached is None:
+        async with get_connection() as conn:
+            if mode == "exact":
+                count = await exact_count(conn, where, params)
+            else:
+                count = await estimate_count(conn, where, params)
+        cached = json.dumps({"count": count, "exact": mode == "exact"}).encode()
+        if cache_key:
+            polygon_cache.put(cache_key, cached)
+    return await compressed_response(request, cached, "application/json", cache_key)
+
+
+@router.post("/api/zdjecia/count")
+async def get_polygon_count(data: CountModel, request: Request):
+    try:
+        if not data.polygon:
+            return JSONResponse(status_code=400, content={"error": "No polygon provided"})
+
+        version = await data_version.get()
+        cache_key = ("count", version, polygon_key(data.polygon)) if version is not None else None
+        where, params = polygon_filter(data.polygon)
+
+        return await selection_count(request, where, params, data, data.mode, cache_key)
+
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        print("Error in /api/zdjecia/count:", e)
+
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@router.get("/api/zdjecia/region/count")
+async def get_region_count(
+    request: Request,
+    level: str = Query(..., regex="^(woj|pow|gmi)$"),
+    jpt_kod: str = Query(...),
+    mode: str = Query("estimate", regex="^(estimate|exact)$"),
+    filters: AttributeFilters = Depends(attribute_filters)
+):
+    try:
+        version = await data_version.get()
+        cache_key = ("count", version, level, jpt_kod) if version is not None else None
+
+        return await selection_count(request, region_filter(level), (jpt_kod,), filters, mode, cache_key)
+
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        print("Error in /api/zdjecia/region/count:", e)
+
+        return JSONResponse(status_code=500, content={"error": str(e)})
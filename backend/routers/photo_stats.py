@@ -0,0 +1,115 @@
+from fastapi.responses import JSONResponse, Response
+from fastapi import APIRouter, Depends, Query, Request
+from psycopg_pool import PoolTimeout
+from psycopg.errors import UndefinedTable
+import json
+
+from ..models import AttributeFilters, SelectionModel
+from ..db import (
+    get_connection,
+    DatabaseTables
+)
+from ..filters import (
+    polygon_filter,
+    region_filter,
+    attribute_filters,
+    attribute_filter,
+    filtered,
+    filters_key
+)
+from ..stats import stats_query, build_stats
+from ..compression import compressed_response
+from ..cache import (
+    data_version,
+    polygon_cache,
+    polygon_key
+)
+
+router = APIRouter()
+
+
+async def selection_stats(
+    request: Request,
+    where: str,
+    params: tuple,
+    filters: AttributeFilters,
+    cache_key: tuple | None
+) -> Response:
+    where, params = filtered(where, params, filters)
+    if cache_key:
+        cache_key = cache_key + (filters_key(filters),)
+
+    cached = polygon_cache.get(cache_key) if cache_key else None
+    if cached is None:
+        async with get_connection() as conn:
+            cur = await conn.execute(stats_query(DatabaseTables.photo_table, where), params)
+            stats = build_stats(await cur.fetchall(), keep_missing=True)
+        cached = json.dumps(stats, ensure_ascii=False, separators=(",", ":")).encode()
+        if cache_key:
+            polygon_cache.put(cache_key, cached)
+    return await compressed_response(request, cached, "application/json", cache_key)
+
+
+async def precomputed_region_stats(level: str, jpt_kod: str) -> bytes | None:
+    """
+    Statystyki regionu przeliczone przez cron (tabela region_stats).
+    None, gdy regionu nie ma w tabeli albo tabela jeszcze nie istnieje.
+    """
+    try:
+        async with get_connection() as conn:
+            cur = await conn.execute(f"""
+                SELECT stats::text FROM {DatabaseTables.region_stats_table}
+                WHERE level = %s AND jpt_kod = %s
+            """, (level, jpt_kod))
+            row = await cur.fetchone()
+    except UndefinedTable:
+        return None
+    return row[0].encode() if row else None
+
+
+@router.post("/api/zdjecia/stats")
+async def get_polygon_stats(data: SelectionModel, request: Request):
+    try:
+        if not data.polygon:
+            return JSONResponse(status_code=400, content={"error": "No polygon provided"})
+
+        version = await data_version.get()
+        cache_key = ("stats", version, polygon_key(data.polygon)) if version is not None else None
+        where, params = polygon_filter(data.polygon)
+
+        return await selection_stats(request, where, params, data, cache_key)
+
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        print("Error in /api/zdjecia/stats:", e)
+
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@router.get("/api/zdjecia/region/stats")
+async def get_region_stats(
+    request: Request,
+    level: str = Query(..., regex="^(woj|pow|gmi)$"),
+    jpt_kod: str = Query(...),
+    filters: AttributeFilters = Depends(attribute_filters)
+):
+    try:
+        version = await data_version.get()
+
+        if attribute_filter(filters)[0] == "TRUE":
+            precomputed = await precomputed_region_stats(level, jpt_kod)
+            if precomputed is not None:
+                cache_key = ("region_stats", version, level, jpt_kod) if version is not None else None
+                return await compressed_response(request, precomputed, "application/json", cache_key)
+
+        cache_key = ("stats", version, level, jpt_kod) if version is not None else None
+
+        return await selection_stats(request, region_filter(level), (jpt_kod,), filters, cache_key)
+
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        print("Error in /api/zdjecia/region/stats:", e)
+
+        return JSONResponse(status_code=500, content={"error": str(e)})
@@ -1,133 +1,317 @@
-from fastapi.responses import JSONResponse
-from fastapi import APIRouter
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi import APIRouter, Depends, Query, Request
+from psycopg_pool import PoolTimeout
+from typing import AsyncIterator
+from uuid import uuid4
+import pyarrow as pa
 import json
+import io
+import os
 
-from ..models import (
-    Feature,
-    FeatureProperties,
-    PolygonModel
-)
+from ..models import AttributeFilters, PolygonModel, precision as default_precision
 from ..db import (
     get_connection,
-    release_connection,
     DatabaseTables
 )
+from ..utils import encode_cursor, decode_cursor
+from ..filters import (
+    polygon_filter,
+    region_filter,
+    attribute_filters,
+    filtered,
+    filters_key
+)
+from ..cache import (
+    data_version,
+    polygon_cache,
+    polygon_key
+)
+from ..compression import compressed_response
+from ..columnar import (
+    ARROW_MEDIA_TYPE,
+    PHOTO_ARROW_COLUMNS,
+    PHOTO_ARROW_SCHEMA,
+    accepts_arrow,
+    rows_to_record_batch
+)
 
 router = APIRouter()
 
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "5000"))
+
+STREAM_MEDIA_TYPES = {
+    "geojson": "application/geo+json",
+    "ndjson": "application/x-ndjson",
+    "arrow": ARROW_MEDIA_TYPE
+}
+
+PHOTO_FEATURE_COLUMNS = """
+    id,
+    json_build_object(
+        'type', 'Feature',
+        'geometry', ST_AsGeoJSON(geometry, %s)::json,
+        'properties', json_build_object(
+            'id', id,
+            'rok_wykonania', rok_wykonania,
+            'kolor', kolor,
+            'charakterystyka_przestrzenna', charakterystyka_przestrzenna,
+            'zrodlo_danych', zrodlo_danych,
+            'url_do_pobrania', url_do_pobrania,
+            'numer_zgloszenia', numer_zgloszenia,
+            'dt_pzgik', dt_pzgik,
+            'data_nalotu', data_nalotu
+        )
+    )::text AS feature_json
+"""
+
+
+def join_features(rows: list[tuple], separator: bytes = b",") -> bytes:
+    """
+    Skleja gotowe obiekty Feature zbudowane przez PostGIS bez ponownego parsowania JSON.
+    """
+    return separator.join(row[1].encode() for row in rows)
+
+
+async def feature_batches(query: str, params: tuple) -> AsyncIterator[list[tuple]]:
+    async with get_connection() as conn:
+        async with conn.cursor(name=f"zdjecia_{uuid4().hex}") as cur:
+            cur.itersize = STREAM_BATCH_SIZE
+            await cur.execute(query, params)
+            while batch := await cur.fetchmany(STREAM_BATCH_SIZE):
+                yield batch
+
+
+async def open_feature_stream(query: str, params: tuple) -> AsyncIterator[list[tuple]]:
+    """
+    Otwiera kursor serwerowy (nazwany) i zwraca generator kolejnych paczek wierszy.
+    Pierwsza paczka jest pobierana od razu, żeby błędy zapytania trafiły do
+    wywołującego zanim zacznie się wysyłanie odpowiedzi.
+    """
+    batches = feature_batches(query, params)
+    first = await anext(batches, None)
+
+    async def primed() -> AsyncIterator[list[tuple]]:
+        try:
+            if first is not None:
+                yield first
+                async for batch in batches:
+                    yield batch
+        finally:
+            await batches.aclose()
+
+    return primed()
+
+
+def next_cursor(row_count: int, last_id: int | None, limit: int) -> str | None:
+    if row_count < limit or last_id is None:
+        return None
+    return encode_cursor(last_id)
+
+
+async def geojson_chunks(batches: AsyncIterator[list[tuple]], limit: int) -> AsyncIterator[bytes]:
+    yield b'{"type":"FeatureCollection","features":['
+    separator = b""
+    row_count = 0
+    last_id = None
+    async for batch in batches:
+        yield separator + join_features(batch)
+        separator = b","
+        row_count += len(batch)
+        last_id = batch[-1][0]
+    yield b'],"next":' + json.dumps(next_cursor(row_count, last_id, limit)).encode() + b"}"
+
+
+async def ndjson_chunks(batches: AsyncIterator[list[tuple]], limit: int) -> AsyncIterator[bytes]:
+    """
+    Jeden obiekt Feature na linię; ostatnia linia to obiekt sterujący {"next": ...}
+    z tokenem do dalszego stronicowania (null, gdy to ostatnia strona).
+    """
+    row_count = 0
+    last_id = None
+    async for batch in batches:
+        yield join_features(batch, b"\n") + b"\n"
+        row_count += len(batch)
+        last_id = batch[-1][0]
+    yield b'{"next":' + json.dumps(next_cursor(row_count, last_id, limit)).encode() + b"}\n"
+
+
+async def arrow_chunks(batches: AsyncIterator[list[tuple]], limit: int) -> AsyncIterator[bytes]:
+    """
+    Zapisuje paczki wierszy jako strumień Arrow IPC, po jednym RecordBatch na paczkę.
+    Ostatni RecordBatch niesie w custom_metadata token "next" do dalszego stronicowania.
+    """
+    sink = io.BytesIO()
+
+    def drain() -> bytes:
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return chunk
+
+    writer = pa.ipc.new_stream(sink, PHOTO_ARROW_SCHEMA)
+    row_count = 0
+    batch = await anext(batches, None)
+    while batch is not None:
+        following = await anext(batches, None)
+        row_count += len(batch)
+        metadata = None
+        if following is None:
+            metadata = {"next": next_cursor(row_count, batch[-1][0], limit) or ""}
+        writer.write_batch(rows_to_record_batch(batch), custom_metadata=metadata)
+        yield drain()
+        batch = following
+    writer.close()
+    yield drain()
+
+
+def feature_collection(rows: list[tuple], limit: int) -> bytes:
+    next_token = next_cursor(len(rows), rows[-1][0] if rows else None, limit)
+    return (
+        b'{"type":"FeatureCollection","features":['
+        + join_features(rows)
+        + b'],"next":' + json.dumps(next_token).encode() + b"}"
+    )
+
+
+async def stream_features(query: str, params: tuple, format: str, limit: int) -> StreamingResponse:
+    batches = await open_feature_stream(query, params)
+    if format == "arrow":
+        chunks = arrow_chunks(batches, limit)
+    elif format == "ndjson":
+        chunks = ndjson_chunks(batches, limit)
+    else:
+        chunks = geojson_chunks(batches, limit)
+    return StreamingResponse(chunks, media_type=STREAM_MEDIA_TYPES[format], headers={"Vary": "Accept"})
+
+
+async def query_photos(
+    request: Request,
+    where: str,
+    where_params: tuple,
+    cursor: str | None,
+    limit: int,
+    stream: bool,
+    format: str,
+    precision: int,
+    filters: AttributeFilters,
+    cache_key: tuple | None = None
+) -> Response:
+    """
+    Wspólna ścieżka endpointów zdjęć: filtry atrybutów, stronicowanie po id,
+    negocjacja formatu (GeoJSON / NDJSON / Arrow), strumieniowanie i cache
+    buforowanych odpowiedzi.
+    """
+    where, where_params = filtered(where, where_params, filters)
+    if cache_key:
+        cache_key = cache_key + (precision, filters_key(filters))
+
+    if accepts_arrow(request.headers.get("accept")):
+        format = "arrow"
+    if format == "arrow":
+        columns, column_params = PHOTO_ARROW_COLUMNS, ()
+    else:
+        columns, column_params = PHOTO_FEATURE_COLUMNS, (precision,)
+
+    query = f"""
+        SELECT {columns}
+        FROM {DatabaseTables.photo_table}
+        WHERE {where}
+        AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """
+    try:
+        params = column_params + where_params + (decode_cursor(cursor), limit)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    if stream or format != "geojson":
+        return await stream_features(query, params, format, limit)
+
+    body = polygon_cache.get(cache_key) if cache_key else None
+    if body is None:
+        async with get_connection() as conn:
+            cur = await conn.execute(query, params)
+            body = feature_collection(await cur.fetchall(), limit)
+        if cache_key:
+            polygon_cache.put(cache_key, body)
+
+    return await compressed_response(
+        request, body, "application/json", cache_key, headers={"Vary": "Accept"}
+    )
+
+
 @router.get("/api/zdjecia")
-def get_zdjecia(skip: int = 0, limit: int = 500_000):
+async def get_zdjecia(
+    request: Request,
+    cursor: str | None = None,
+    limit: int = Query(500_000, ge=1),
+    stream: bool = False,
+    format: str = Query("geojson", regex="^(geojson|ndjson)$"),
+    precision: int = Query(default_precision, ge=0, le=15),
+    filters: AttributeFilters = Depends(attribute_filters)
+):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(f"""
-            SELECT id, ST_AsGeoJSON(geometry) AS geometry_json, rok_wykonania, kolor, charakterystyka_przestrzenna, zrodlo_danych, url_do_pobrania, numer_zgloszenia, dt_pzgik, data_nalotu
-            FROM {DatabaseTables.photo_table}
-            ORDER BY id
-            OFFSET %s LIMIT %s
-        """, (skip, limit))
-        
-        rows = cur.fetchall()
-        result = []
-
-        for row in rows:
-            id = row[0]
-            geometry = row[1]
-            rok_wykonania = row[2]
-            kolor = row[3]
-            charakterystyka_przestrzenna = row[4]
-            zrodlo_danych = row[5]
-            url_do_pobrania = row[6] 
-            numer_zgloszenia = row[7]
-            dt_pzgik = row[8]
-            data_nalotu = row[9]
-            feature = Feature(
-                geometry=json.loads(geometry),
-                properties=FeatureProperties(
-                    id=id,
-                    rok_wykonania=rok_wykonania,
-                    kolor=kolor,
-                    charakterystyka_przestrzenna=charakterystyka_przestrzenna,
-                    zrodlo_danych=zrodlo_danych,
-                    url_do_pobrania=url_do_pobrania,
-                    numer_zgloszenia=numer_zgloszenia,
-                    dt_pzgik=dt_pzgik,
-                    data_nalotu=data_nalotu
-                )
-            )
-            result.append(feature)
-
-        return {"type": "FeatureCollection", "features": result}
+        return await query_photos(request, "TRUE", (), cursor, limit, stream, format, precision, filters)
 
+    except PoolTimeout:
+        raise
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            release_connection(conn)
 
+@router.get("/api/zdjecia/region")
+async def get_zdjecia_region(
+    request: Request,
+    level: str = Query(..., regex="^(woj|pow|gmi)$"),
+    jpt_kod: str = Query(...),
+    cursor: str | None = None,
+    limit: int = Query(500_000, ge=1),
+    stream: bool = False,
+    format: str = Query("geojson", regex="^(geojson|ndjson)$"),
+    precision: int = Query(default_precision, ge=0, le=15),
+    filters: AttributeFilters = Depends(attribute_filters)
+):
+    try:
+        where = region_filter(level)
+
+        version = await data_version.get()
+        cache_key = (version, level, jpt_kod, cursor, limit) if version is not None else None
+
+        return await query_photos(
+            request, where, (jpt_kod,), cursor, limit, stream, format, precision, filters, cache_key
+        )
+
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        print("Error in /api/zdjecia/region:", e)
+
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
 
 @router.post("/api/zdjecia/filter")
-async def filter_zdjecia(data: PolygonModel):
+async def filter_zdjecia(data: PolygonModel, request: Request):
     try:
         polygon_geojson = data.polygon
         if not polygon_geojson:
             return JSONResponse(status_code=400, content={"error": "No polygon provided"})
 
-        if isinstance(polygon_geojson, dict):
-            polygon_geojson = json.dumps(polygon_geojson)
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(f"""
-            SELECT id, ST_AsGeoJSON(geometry) AS geometry_json, rok_wykonania, kolor, charakterystyka_przestrzenna, zrodlo_danych, url_do_pobrania, numer_zgloszenia, dt_pzgik, data_nalotu
-            FROM {DatabaseTables.photo_table}
-            WHERE ST_Intersects(geometry, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326))
-            ORDER BY id
-            OFFSET %s LIMIT %s
-        """, (polygon_geojson,data.skip, data.limit))
-
-        rows = cur.fetchall()
-        result = []
-        for row in rows:
-            id = row[0]
-            geometry = row[1]
-            rok_wykonania = row[2]
-            kolor = row[3]  
-            charakterystyka_przestrzenna = row[4]
-            zrodlo_danych = row[5]
-            url_do_pobrania = row[6] 
-            numer_zgloszenia = row[7] 
-            dt_pzgik = row[8]
-            data_nalotu = row[9]
-            feature = Feature(
-                geometry=json.loads(geometry),
-                properties=FeatureProperties(
-                    id=id,
-                    rok_wykonania=rok_wykonania,
-                    kolor=kolor,
-                    charakterystyka_przestrzenna=charakterystyka_przestrzenna,
-                    zrodlo_danych=zrodlo_danych,
-                    url_do_pobrania=url_do_pobrania,
-                    numer_zgloszenia=numer_zgloszenia,
-                    dt_pzgik=dt_pzgik,
-                    data_nalotu=data_nalotu
-                )
-            )
-            result.append(feature)
-
-        return {"type": "FeatureCollection", "features": result}
+        version = await data_version.get()
+        cache_key = None
+        if version is not None:
+            cache_key = (version, polygon_key(polygon_geojson), data.cursor, data.limit)
 
+        where, params = polygon_filter(polygon_geojson)
+
+        return await query_photos(
+            request, where, params, data.cursor, data.limit, data.stream, data.format, data.precision,
+            data, cache_key
+        )
+
+    except PoolTimeout:
+        raise
     except Exception as e:
         print("Error in /api/zdjecia/filter:", e)
 
         return JSONResponse(status_code=500, content={"error": str(e)})
-
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            release_connection(conn)
\ No newline at end of file
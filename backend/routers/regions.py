@@ -1,87 +1,99 @@
 from fastapi.responses import JSONResponse
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Request
 import json
 
 from ..models import (
     Region,
-    RegionProperties
+    RegionProperties,
+    precision as default_precision
 )
 from ..db import (
     get_connection,
-    release_connection,
-    DatabaseTables
+    DatabaseTables,
+    region_simplify_tolerances
 )
+from ..cache import (
+    data_version,
+    polygon_cache,
+    region_hierarchy
+)
+from ..compression import compressed_response
 
 
 router = APIRouter()
 
 @router.get("/api/wojewodztwa")
-def get_wojewodztwa():
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(f"""
-            SELECT "JPT_KOD_JE", "JPT_NAZWA_", "area_2180_km2" FROM {DatabaseTables.woj_table} ORDER BY "JPT_NAZWA_"
-        """)
-        wojewodztwa = [{"id": row[0], "name": row[1], "area": row[2]} for row in cur.fetchall()]
-        return JSONResponse(content=wojewodztwa)
-    finally:
-        cur.close()
-        release_connection(conn)
+async def get_wojewodztwa():
+    hierarchy = await region_hierarchy.get()
+    return JSONResponse(content=hierarchy.wojewodztwa)
 
 @router.get("/api/powiaty")
-def get_powiaty(woj_id: str):
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(f"""
-            SELECT "JPT_KOD_JE", "JPT_NAZWA_", "area_2180_km2" FROM {DatabaseTables.pow_table}
-            WHERE woj_kod = %s ORDER BY "JPT_NAZWA_"
-        """, (woj_id,))
-        powiaty = [{"id": row[0], "name": row[1], "area": row[2]} for row in cur.fetchall()]
-        return JSONResponse(content=powiaty)
-    finally:
-        cur.close()
-        release_connection(conn)
+async def get_powiaty(woj_id: str):
+    hierarchy = await region_hierarchy.get()
+    return JSONResponse(content=hierarchy.powiaty.get(woj_id, []))
 
 
 @router.get("/api/gminy")
-def get_gminy(powiat_id: str):
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(f"""
-            SELECT "JPT_KOD_JE", "JPT_NAZWA_", "area_2180_km2" FROM {DatabaseTables.gmi_table}
-            WHERE pow_kod = %s ORDER BY "JPT_NAZWA_"
-        """, (powiat_id,))
-        gminy = [{"id": row[0], "name": row[1], "area": row[2]} for row in cur.fetchall()]
-        return JSONResponse(content=gminy)
-    finally:
-        cur.close()
-        release_connection(conn)
+async def get_gminy(powiat_id: str):
+    hierarchy = await region_hierarchy.get()
+    return JSONResponse(content=hierarchy.gminy.get(powiat_id, []))
+
+
+def simplify_tolerance(zoom: int | None, tolerance: float | None) -> float | None:
+    """
+    Wybiera największą przeliczoną tolerancję uproszczenia (w stopniach) nie większą
+    niż żądana. Dla zoomu żądaną tolerancją jest rozmiar piksela kafla 256 px.
+    None oznacza pełną geometrię.
+    """
+    if tolerance is None and zoom is not None:
+        tolerance = 360 / (256 * 2 ** zoom)
+    if tolerance is None:
+        return None
+    available = [t for t in region_simplify_tolerances if t <= tolerance]
+    return available[-1] if available else None
 
 
 @router.get("/api/region")
-def get_region(level: str = Query(..., regex="^(woj|pow|gmi)$"),
-               jpt_kod: str = Query(...)):
-    table = {"woj": DatabaseTables.woj_table, "pow": DatabaseTables.pow_table, "gmi": DatabaseTables.gmi_table}[level]
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            f'SELECT "JPT_KOD_JE", ST_AsGeoJSON(geometry), "JPT_NAZWA_", "area_2180_km2" '
-            f'FROM {table} WHERE "JPT_KOD_JE" = %s', (jpt_kod,)
-        )
-        row = cur.fetchone()
+async def get_region(request: Request,
+                     level: str = Query(..., regex="^(woj|pow|gmi)$"),
+                     jpt_kod: str = Query(...),
+                     precision: int = Query(default_precision, ge=0, le=15),
+                     zoom: int | None = Query(None, ge=0, le=24),
+                     tolerance: float | None = Query(None, ge=0)):
+    tolerance = simplify_tolerance(zoom, tolerance)
+    version = await data_version.get()
+    cache_key = ("region", version, level, jpt_kod, precision, tolerance) if version is not None else None
+
+    body = polygon_cache.get(cache_key) if cache_key else None
+    if body is None:
+        table = DatabaseTables.region_table(level)
+        async with get_connection() as conn:
+            if tolerance is None:
+                cur = await conn.execute(
+                    f'SELECT "JPT_KOD_JE", ST_AsGeoJSON(geometry, %s), "JPT_NAZWA_", "area_2180_km2" '
+                    f'FROM {table} WHERE "JPT_KOD_JE" = %s', (precision, jpt_kod)
+                )
+            else:
+                cur = await conn.execute(
+                    f'SELECT r."JPT_KOD_JE", ST_AsGeoJSON(s.geometry, %s), r."JPT_NAZWA_", r."area_2180_km2" '
+                    f'FROM {table} r JOIN {DatabaseTables.simplified_table(level)} s '
+                    f'ON s.jpt_kod = r."JPT_KOD_JE" AND s.tolerance = %s '
+                    f'WHERE r."JPT_KOD_JE" = %s', (precision, tolerance, jpt_kod)
+                )
+            row = await cur.fetchone()
         if row is None:
             return JSONResponse(status_code=404, content={"error": "Geometria nie znaleziona"})
 
         kod, geom_json, nazwa, area = row
         region = Region(
             geometry=json.loads(geom_json),
-            properties=RegionProperties(level=level, kod=kod, nazwa=nazwa, area=area)
+            properties=RegionProperties(level=level, kod=kod, nazwa=nazwa, area=area, tolerance=tolerance)
         )
-        return {"type": "FeatureCollection", "features": [region]}
-    finally:
-        cur.close()
-        release_connection(conn)
\ No newline at end of file
+        body = json.dumps(
+            {"type": "FeatureCollection", "features": [region.model_dump()]},
+            ensure_ascii=False, separators=(",", ":")
+        ).encode()
+        if cache_key:
+            polygon_cache.put(cache_key, body)
+
+    return await compressed_response(request, body, "application/json", cache_key)
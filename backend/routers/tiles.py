@@ -1,24 +1,108 @@
-import json
+import asyncio
 import os
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+from psycopg_pool import PoolTimeout
 from pathlib import Path
 
+from ..db import get_connection
+from ..compression import compressed_response
+from ..conditional import make_etag, etag_matches, cache_headers, not_modified
+from ..tiling.generate_tiles import count_query, needs_count, tile_query
+from ..tiling.tile_store import MBTilesReader, write_file_atomic, tiles_format, mbtiles_name
+
 router = APIRouter()
 
 TILES_DIR = Path(os.getenv("TILES_OUTPUT_DIR", "backend/tiling/tiles"))
 STATS_FILE = TILES_DIR / "stats.json"
+TILES_ON_DEMAND = os.getenv("TILES_ON_DEMAND", "false").lower() in ("1", "true", "yes")
+TILES_ON_DEMAND_MAX_ZOOM = int(os.getenv("TILES_ON_DEMAND_MAX_ZOOM", "18"))
+
+# W trybie mbtiles kafle z crona czytane są z archiwum; katalog trzyma tylko kafle z renderowania na żądanie.
+mbtiles_reader = MBTilesReader(TILES_DIR / mbtiles_name) if tiles_format == "mbtiles" else None
+
+# Renderowania w toku: równoczesne żądania tego samego kafla czekają na jedno zapytanie.
+inflight_tiles: dict[tuple[int, int, int], asyncio.Task] = {}
+
+
+async def file_response(request: Request, path: Path, media_type: str):
+    """
+    Odpowiedź z pliku wygenerowanego przez cron. Skompresowana treść i ETag
+    wyznaczane są z (ścieżka, mtime), więc podmiana pliku je unieważnia.
+    Pusty plik oznacza kafel bez danych (204).
+    """
+    stat = path.stat()
+    cache_key = ("file", str(path), stat.st_mtime_ns)
+    etag = make_etag(*cache_key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    if stat.st_size == 0:
+        return Response(status_code=204, headers=cache_headers(etag))
+    return await compressed_response(request, path.read_bytes(), media_type, cache_key, cache_headers(etag))
+
+
+async def render_tile(z: int, x: int, y: int, path: Path) -> None:
+    """
+    Renderuje kafel tym samym zapytaniem ST_AsMVT co MVTGenerator (poza DBSCAN
+    bez osobnego liczenia obiektów) i zapisuje go w katalogu kafli (kafel bez
+    danych jako pusty plik).
+    """
+    async with get_connection() as conn:
+        n = None
+        if needs_count(z):
+            cur = await conn.execute(count_query(), (z, x, y))
+            n = (await cur.fetchone())[0]
+        tile_bytes = b""
+        if n != 0:
+            sql, params = tile_query(z, x, y, n)
+            cur = await conn.execute(sql, params)
+            row = await cur.fetchone()
+            tile_bytes = bytes(row[0]) if row and row[0] and row[1] else b""
+    await asyncio.to_thread(write_file_atomic, path, tile_bytes)
+
+
+async def ensure_tile(z: int, x: int, y: int, path: Path) -> None:
+    key = (z, x, y)
+    task = inflight_tiles.get(key)
+    if task is None:
+        task = asyncio.create_task(render_tile(z, x, y, path))
+        inflight_tiles[key] = task
+        task.add_done_callback(lambda _: inflight_tiles.pop(key, None))
+    # shield: rozłączenie jednego klienta nie przerywa renderowania dla pozostałych
+    await asyncio.shield(task)
+
 
 @router.get("/tiling/tiles/stats.json")
-async def get_stats():
+async def get_stats(request: Request):
     if not STATS_FILE.exists():
         return JSONResponse(status_code=404, content={"error": "Plik stats.json nie istnieje"})
-    with open(STATS_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return JSONResponse(content=data)
+    return await file_response(request, STATS_FILE, "application/json")
 
 @router.get("/tiling/tiles/{z}/{x}/{y}.pbf")
-async def get_tile(z: int, x: int, y: int):
+async def get_tile(request: Request, z: int, x: int, y: int):
+    if z < 0 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return JSONResponse(status_code=404, content={"error": "Nieprawidłowe współrzędne kafla"})
+
+    if mbtiles_reader is not None:
+        tile_bytes = mbtiles_reader.get(z, x, y)
+        if tile_bytes is not None:
+            cache_key = ("mbtiles", mbtiles_reader.identity, z, x, y)
+            etag = make_etag(*cache_key)
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return not_modified(etag)
+            return await compressed_response(
+                request, tile_bytes, "application/x-protobuf", cache_key, cache_headers(etag)
+            )
+
     tile_path = TILES_DIR / str(z) / str(x) / f"{y}.pbf"
-    if tile_path.exists():
-        return FileResponse(tile_path, media_type="application/x-protobuf")
+    if not tile_path.exists():
+        if not TILES_ON_DEMAND or z > TILES_ON_DEMAND_MAX_ZOOM:
+            return Response(status_code=204)
+        try:
+            await ensure_tile(z, x, y, tile_path)
+        except PoolTimeout:
+            raise
+        except Exception as e:
+            print(f"Error rendering tile {z}/{x}/{y}: {e}")
+            return JSONResponse(status_code=500, content={"error": str(e)})
+    return await file_response(request, tile_path, "application/x-protobuf")
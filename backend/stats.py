@@ -0,0 +1,88 @@
+STATS_DIMENSIONS = (
+    "photo_type",
+    "years",
+    "color",
+    "report_numbers",
+    "dt_pzgik_rok_correlation",
+    "flight_dates"
+)
+
+
+def stats_query(source: str, where: str = "TRUE", group_by: str | None = None) -> str:
+    """
+    Zapytanie liczące w jednym przebiegu wszystkie rozkłady pokazywane w panelu
+    i na wykresach (GROUPING SETS). Opcjonalny `group_by` dokłada kolumnę
+    grupującą (np. kod regionu) jako pierwszą kolumnę wyniku.
+    """
+    key = f"{group_by}, " if group_by else ""
+    return f"""
+        SELECT
+            {key}
+            CASE
+                WHEN GROUPING(zrodlo_danych) = 0 THEN 'photo_type'
+                WHEN GROUPING(dt_pzgik) = 0 THEN 'dt_pzgik_rok_correlation'
+                WHEN GROUPING(rok_wykonania) = 0 THEN 'years'
+                WHEN GROUPING(kolor) = 0 THEN 'color'
+                WHEN GROUPING(numer_zgloszenia) = 0 THEN 'report_numbers'
+                ELSE 'flight_dates'
+            END AS dimension,
+            zrodlo_danych,
+            charakterystyka_przestrzenna,
+            rok_wykonania,
+            kolor,
+            numer_zgloszenia,
+            data_nalotu,
+            dt_pzgik,
+            COUNT(*) AS count
+        FROM {source}
+        WHERE {where}
+        GROUP BY GROUPING SETS (
+            ({key}zrodlo_danych, charakterystyka_przestrzenna),
+            ({key}rok_wykonania),
+            ({key}kolor),
+            ({key}numer_zgloszenia),
+            ({key}data_nalotu),
+            ({key}dt_pzgik, rok_wykonania)
+        )
+    """
+
+
+def build_stats(rows: list[tuple], keep_missing: bool = False) -> dict:
+    """
+    Składa wiersze z `stats_query` w strukturę stats.json.
+    Przy `keep_missing` brakujące kolory i daty nalotu są liczone pod kluczem None,
+    tak jak robi to frontend licząc statystyki z pobranych obiektów.
+    """
+    stats = {dimension: {} for dimension in STATS_DIMENSIONS}
+    stats["count"] = 0
+    for dimension, zrodlo, res, rok, kolor, numer_zgloszenia, data_nalotu, dt_pzgik, count in rows:
+        if dimension == "photo_type":
+            try:
+                numeric_res = float(res)
+            except (TypeError, ValueError):
+                numeric_res = res
+            resolution = stats["photo_type"].setdefault(zrodlo, {"resolution": {}})["resolution"]
+            resolution[numeric_res] = resolution.get(numeric_res, 0) + count
+            stats["count"] += count
+        elif dimension == "years" and rok:
+            stats["years"][rok] = count
+        elif dimension == "color" and (kolor or keep_missing):
+            stats["color"][kolor] = count
+        elif dimension == "report_numbers" and numer_zgloszenia:
+            stats["report_numbers"][numer_zgloszenia] = count
+        elif dimension == "flight_dates" and (data_nalotu or keep_missing):
+            stats["flight_dates"][data_nalotu] = count
+        elif dimension == "dt_pzgik_rok_correlation" and dt_pzgik and rok:
+            stats["dt_pzgik_rok_correlation"].setdefault(dt_pzgik, {})[rok] = count
+    return stats
+
+
+def build_grouped_stats(rows: list[tuple], keep_missing: bool = False) -> dict:
+    """
+    Jak `build_stats`, dla wierszy z `stats_query(..., group_by=...)`:
+    zwraca słownik {wartość kolumny grupującej: stats}.
+    """
+    grouped = {}
+    for key, *row in rows:
+        grouped.setdefault(key, []).append(row)
+    return {key: build_stats(group, keep_missing) for key, group in grouped.items()}
@@ -1,9 +1,16 @@
 import psycopg2
 import mercantile
+import math
 import os
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Iterator
 from dotenv import load_dotenv
 
+from ..stats import stats_query, build_stats
+from .tile_store import DirectoryTileWriter, MBTilesWriter, tiles_format, mbtiles_name
+
 load_dotenv()
 dbname = os.getenv("POSTGRES_DB")
 user = os.getenv("POSTGRES_USER")
@@ -14,9 +21,246 @@ photo_table = os.getenv("PHOTO_TABLE", "zdjecia_lotnicze")
 tiles_output_dir = os.getenv("TILES_OUTPUT_DIR", "tiles")
 tiles_min_zoom = int(os.getenv("TILES_MIN_ZOOM", "3"))
 tiles_max_zoom = int(os.getenv("TILES_MAX_ZOOM", "12"))
+tiles_workers = int(os.getenv("TILES_WORKERS", "1"))
+# "grid": kafle poniżej TILES_MAX_ZOOM z piramidy klastrów siatkowych; "dbscan": dawne grupowanie per kafel
+tiles_clustering = os.getenv("TILES_CLUSTERING", "grid")
+tiles_cluster_grid = int(os.getenv("TILES_CLUSTER_GRID", "64"))
+
+# Pół obwodu Ziemi w EPSG:3857 (granica świata Web Mercator)
+WEB_MERCATOR_HALF = 20037508.342789244
 
 # python -m backend.tiling.generate_tiles
 
+def get_dynamic_limit(n: int, z: int, max_clusters: int = 50000) -> int:
+    """Dobiera max_clusters jako procent obiektów zależnie od zoom"""
+    if z <= 5:
+        percent = 0.05
+    elif z <= 8:
+        percent = 0.3
+    elif z <= 10:
+        percent = 0.55
+    elif z < tiles_max_zoom:
+        percent = 0.8
+    else:
+        return n
+
+    return min(int(n * percent), max_clusters)
+
+
+def get_dynamic_eps(n: int) -> int:
+    """Dobiera eps zależnie od liczby obiektów"""
+    if n < 500: return 5
+    elif n < 15000: return 10
+    elif n < 50000: return 25
+    elif n < 150000: return 45
+    elif n < 500000: return 70
+    elif n < 1000000: return 100
+    else: return 125
+
+
+def count_query(table_name: str = photo_table, geom_column: str = "geometry") -> str:
+    """Zapytanie liczące obiekty w kaflu (parametry: z, x, y)"""
+    return f"""
+    SELECT COUNT(*)
+    FROM {table_name}
+    WHERE ST_Intersects(
+        {geom_column},
+        ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326)
+    );
+    """
+
+
+def needs_count(z: int, clustering: str = tiles_clustering) -> bool:
+    """
+    Czy tile_query wymaga wcześniejszego count_query: tylko DBSCAN dobiera eps
+    i limit klastrów z liczby punktów (eps musi być stałą w zapytaniu).
+    """
+    return z < tiles_max_zoom and clustering == "dbscan"
+
+
+def cluster_table(table_name: str = photo_table) -> str:
+    return f"{table_name}_clusters"
+
+
+def cluster_pyramid_queries(
+    zoom_min: int,
+    zoom_max: int,
+    table_name: str = photo_table,
+    geom_column: str = "geometry",
+    grid: int = tiles_cluster_grid
+) -> list[str]:
+    """
+    Zapytania budujące piramidę klastrów: na każdym zoomie kafel dzielony jest na
+    grid x grid komórek, a klaster to suma punktów komórki (środek ciężkości
+    z sum współrzędnych). Najdrobniejszy poziom liczony jest raz z punktów,
+    każdy wyższy z czterech komórek-dzieci, więc całość to jeden przebieg po tabeli.
+    Komórki nie przecinają granic kafli, więc klastry sąsiednich kafli są spójne.
+    """
+    clusters = cluster_table(table_name)
+    finest_cell = 2 * WEB_MERCATOR_HALF / (2 ** zoom_max * grid)
+    queries = [
+        f"""
+        CREATE TABLE IF NOT EXISTS {clusters} (
+            zoom INTEGER NOT NULL,
+            cx BIGINT NOT NULL,
+            cy BIGINT NOT NULL,
+            sum_x DOUBLE PRECISION NOT NULL,
+            sum_y DOUBLE PRECISION NOT NULL,
+            point_count BIGINT NOT NULL,
+            rok_sum BIGINT,
+            rok_count BIGINT NOT NULL,
+            geom geometry(Point, 3857),
+            PRIMARY KEY (zoom, cx, cy)
+        );
+        """,
+        f"DELETE FROM {clusters};",
+        f"""
+        INSERT INTO {clusters} (zoom, cx, cy, sum_x, sum_y, point_count, rok_sum, rok_count)
+        SELECT {zoom_max},
+            floor((x + {WEB_MERCATOR_HALF}) / {finest_cell})::bigint AS cx,
+            floor(({WEB_MERCATOR_HALF} - y) / {finest_cell})::bigint AS cy,
+            SUM(x), SUM(y), COUNT(*), SUM(rok_wykonania), COUNT(rok_wykonania)
+        FROM (
+            SELECT ST_X(p) AS x, ST_Y(p) AS y, rok_wykonania
+            FROM (
+                SELECT ST_Transform({geom_column}, 3857) AS p, rok_wykonania
+                FROM {table_name}
+            ) projected
+        ) points
+        GROUP BY 2, 3;
+        """
+    ]
+    for z in range(zoom_max - 1, zoom_min - 1, -1):
+        queries.append(f"""
+        INSERT INTO {clusters} (zoom, cx, cy, sum_x, sum_y, point_count, rok_sum, rok_count)
+        SELECT {z}, cx / 2, cy / 2, SUM(sum_x), SUM(sum_y), SUM(point_count), SUM(rok_sum), SUM(rok_count)
+        FROM {clusters}
+        WHERE zoom = {z + 1}
+        GROUP BY cx / 2, cy / 2;
+        """)
+    queries.append(f"""
+        UPDATE {clusters}
+        SET geom = ST_SetSRID(ST_MakePoint(sum_x / point_count, sum_y / point_count), 3857);
+    """)
+    queries.append(f"ANALYZE {clusters};")
+    return queries
+
+
+def tile_query(
+    z: int,
+    x: int,
+    y: int,
+    n: int | None = None,
+    table_name: str = photo_table,
+    geom_column: str = "geometry",
+    clustering: str = tiles_clustering,
+    grid: int = tiles_cluster_grid
+) -> tuple[str, tuple]:
+    """
+    Zapytanie ST_AsMVT dla kafla: pełne dane od tiles_max_zoom, poniżej klastry
+    z piramidy (clustering="grid") albo grupowanie DBSCAN. Zwraca (sql, parametry);
+    wiersz wyniku to (kafel, liczba obiektów w kaflu), a kafel bez danych ma n = 0.
+    Liczba punktów n potrzebna jest tylko dla DBSCAN (patrz needs_count).
+    Wspólne dla generatora i renderowania kafli na żądanie w API.
+    """
+    # Pobieranie pełnych danych dla wysokich zoomów
+    if z >= tiles_max_zoom:
+        sql = f"""
+        WITH mvtgeom AS (
+            SELECT ST_AsMVTGeom(
+                    ST_Transform({geom_column}, 3857),
+                    ST_Transform(ST_TileEnvelope(%s, %s, %s), 3857),
+                    4096, 0, true
+                ) AS geom,
+                id,
+                rok_wykonania
+            FROM {table_name}
+            WHERE ST_Intersects(
+                {geom_column},
+                ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326)
+            )
+        )
+        SELECT ST_AsMVT(mvtgeom.*, 'layer', 4096, 'geom') AS tile, COUNT(*) AS n
+        FROM mvtgeom;
+        """
+        params = (z, x, y, z, x, y)
+
+    elif clustering == "grid":
+        # Wycinek piramidy klastrów: komórki siatki należące do kafla
+        sql = f"""
+        WITH mvtgeom AS (
+            SELECT ST_AsMVTGeom(
+                    geom,
+                    ST_TileEnvelope(%s, %s, %s),
+                    4096, 0, true
+                ) AS geom,
+                point_count,
+                CAST(rok_sum::numeric / NULLIF(rok_count, 0) AS INTEGER) AS rok_wykonania
+            FROM {cluster_table(table_name)}
+            WHERE zoom = %s
+            AND cx BETWEEN %s AND %s
+            AND cy BETWEEN %s AND %s
+        )
+        SELECT ST_AsMVT(mvtgeom.*, 'layer', 4096, 'geom') AS tile, COUNT(*) AS n
+        FROM mvtgeom;
+        """
+        params = (z, x, y, z, x * grid, (x + 1) * grid - 1, y * grid, (y + 1) * grid - 1)
+
+    else:
+        # Pobieranie danych i grupowanie DBSCAN dla niższych zoomów
+        eps_value = get_dynamic_eps(n)
+        max_clusters = get_dynamic_limit(n, z)
+
+        sql = f"""
+        WITH clusters AS (
+            SELECT 
+                COALESCE(cluster_id::text, 'single_' || id::int) AS cid,
+                ST_Transform({geom_column}, 3857) AS geom_3857,
+                id
+            FROM (
+                SELECT 
+                    {geom_column},
+                    id,
+                    ST_ClusterDBSCAN(ST_Transform({geom_column}, 3857), eps := {eps_value}, minpoints := 2)
+                        OVER () AS cluster_id
+                FROM {table_name}
+                WHERE ST_Intersects(
+                    {geom_column},
+                    ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326)
+                )
+            ) sub
+        ),
+
+        grouped AS (
+        SELECT 
+            ST_Centroid(ST_Collect(geom_3857)) AS geom_3857,
+            CAST(AVG(rok_wykonania) AS INTEGER) AS rok_wykonania
+        FROM clusters
+        JOIN {table_name} USING(id)
+        GROUP BY cid
+        ),
+        limited AS (
+            SELECT * 
+            FROM grouped
+            ORDER BY random()
+            LIMIT %s
+        ),
+        mvtgeom AS (
+            SELECT ST_AsMVTGeom(
+                    geom_3857,
+                    ST_Transform(ST_TileEnvelope(%s, %s, %s), 3857),
+                    4096, 0, true
+                ) AS geom, rok_wykonania
+            FROM limited
+        )
+        SELECT ST_AsMVT(mvtgeom.*, 'layer', 4096, 'geom') AS tile, COUNT(*) AS n
+        FROM mvtgeom;
+        """
+        params = (z, x, y, max_clusters, z, x, y)
+
+    return sql, params
+
+
 class MVTGenerator:
     def __init__(
         self,
@@ -24,6 +268,7 @@ class MVTGenerator:
         table_name: str = photo_table,
         geom_column: str = "geometry"
     ):
+        self.db_config = db_config
         self.conn = psycopg2.connect(**db_config)
         self.table_name = table_name
         self.geom_column = geom_column
@@ -48,206 +293,259 @@ class MVTGenerator:
 
     def count_features_in_tile(self, z: int, x: int, y: int) -> int:
         """Liczy obiekty w danym kaflu"""
-        sql = f"""
-        SELECT COUNT(*)
-        FROM {self.table_name}
-        WHERE ST_Intersects(
-            {self.geom_column},
-            ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326)
-        );
-        """
         with self.conn.cursor() as cur:
-            cur.execute(sql, (z, x, y))
+            cur.execute(count_query(self.table_name, self.geom_column), (z, x, y))
             return cur.fetchone()[0]
         
 
     def save_stats(self, out_file: str = "stats.json") -> None:
-        sql = f"""
-        SELECT 
-            rok_wykonania,
-            charakterystyka_przestrzenna,
-            kolor,
-            zrodlo_danych,
-            numer_zgloszenia,
-            dt_pzgik,
-            data_nalotu
-        FROM {self.table_name};
-        """
         with self.conn.cursor() as cur:
-            cur.execute(sql)
+            cur.execute(stats_query(self.table_name))
             rows = cur.fetchall()
-        
-        stats = {
-            "photo_type": {},
-            "years": {},
-            "color": {},
-            "report_numbers": {},
-            "dt_pzgik_rok_correlation": {},
-            "flight_dates": {}
-        }
+
         try:
             print(f"Saving statistics for tiles to {out_file}.")
-            for rok, res, kolor, zrodlo, numer_zgloszenia, dt_pzgik, data_nalotu in rows:
-                if zrodlo not in stats["photo_type"]:
-                    stats["photo_type"][zrodlo] = {"resolution": {}}
-                try:
-                    numeric_res = float(res)
-                except:
-                    numeric_res = res
-
-                stats["photo_type"][zrodlo]["resolution"][numeric_res] = stats["photo_type"][zrodlo]["resolution"].get(numeric_res, 0) + 1
-                if rok:
-                    stats["years"][rok] = stats["years"].get(rok, 0) + 1
-                if kolor:
-                    stats["color"][kolor] = stats["color"].get(kolor, 0) + 1
-                    
-                if numer_zgloszenia:
-                    stats["report_numbers"][numer_zgloszenia] = stats["report_numbers"].get(numer_zgloszenia, 0) + 1
-                if data_nalotu:
-                    stats["flight_dates"][data_nalotu] = stats["flight_dates"].get(data_nalotu, 0) + 1
-
-
-                if dt_pzgik and rok:
-                    if dt_pzgik not in stats["dt_pzgik_rok_correlation"]:
-                        stats["dt_pzgik_rok_correlation"][dt_pzgik] = {}
-                    stats["dt_pzgik_rok_correlation"][dt_pzgik][rok] = stats["dt_pzgik_rok_correlation"][dt_pzgik].get(rok, 0) + 1
-                
+            stats = build_stats(rows)
             with open(out_file, "w", encoding="utf-8") as f:
                 json.dump(stats, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"Error while saving stats: {e}")
 
-    def get_dynamic_limit(self, n: int, z: int, max_clusters: int = 50000) -> int:
-        """Dobiera max_clusters jako procent obiektów zależnie od zoom"""
-        if z <= 5:
-            percent = 0.05
-        elif z <= 8:
-            percent = 0.3
-        elif z <= 10:
-            percent = 0.55
-        elif z < tiles_max_zoom:
-            percent = 0.8
-        else:
-            return n
-
-        return min(int(n * percent), max_clusters)
-
-
-    def get_dynamic_eps(self, n: int) -> int:
-        """Dobiera eps zależnie od liczby obiektów"""
-        if n < 500: return 5
-        elif n < 15000: return 10
-        elif n < 50000: return 25
-        elif n < 150000: return 45
-        elif n < 500000: return 70
-        elif n < 1000000: return 100
-        else: return 125
-
-    def get_tile(self, z: int, x: int, y: int) -> bytes | None:
-        """Generuje kafel MVT z dynamicznym DBSCAN lub pełnymi danymi"""
-        n = self.count_features_in_tile(z, x, y)
-        if n == 0:
-            return None
-
-        # Pobieranie pełnych danych dla wysokich zoomów
-        if z >= tiles_max_zoom:
-            sql = f"""
-            WITH mvtgeom AS (
-                SELECT ST_AsMVTGeom(
-                        ST_Transform({self.geom_column}, 3857),
-                        ST_Transform(ST_TileEnvelope(%s, %s, %s), 3857),
-                        4096, 0, true
-                    ) AS geom,
-                    id,
-                    rok_wykonania
-                FROM {self.table_name}
-                WHERE ST_Intersects(
-                    {self.geom_column},
-                    ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326)
-                )
-            )
-            SELECT ST_AsMVT(mvtgeom.*, 'layer', 4096, 'geom') AS tile
-            FROM mvtgeom;
-            """
-            params = (z, x, y, z, x, y)
-
-        else:
-            # Pobieranie danych i grupowanie DBSCAN dla niższych zoomów
-            eps_value = self.get_dynamic_eps(n)
-            max_clusters = self.get_dynamic_limit(n, z)
-
-            sql = f"""
-            WITH clusters AS (
-                SELECT 
-                    COALESCE(cluster_id::text, 'single_' || id::int) AS cid,
-                    ST_Transform({self.geom_column}, 3857) AS geom_3857,
-                    id
-                FROM (
-                    SELECT 
-                        {self.geom_column},
-                        id,
-                        ST_ClusterDBSCAN(ST_Transform({self.geom_column}, 3857), eps := {eps_value}, minpoints := 2)
-                            OVER () AS cluster_id
-                    FROM {self.table_name}
-                    WHERE ST_Intersects(
-                        {self.geom_column},
-                        ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326)
-                    )
-                ) sub
-            ),
-
-            grouped AS (
-            SELECT 
-                ST_Centroid(ST_Collect(geom_3857)) AS geom_3857,
-                CAST(AVG(rok_wykonania) AS INTEGER) AS rok_wykonania
-            FROM clusters
-            JOIN {self.table_name} USING(id)
-            GROUP BY cid
-            ),
-            limited AS (
-                SELECT * 
-                FROM grouped
-                ORDER BY random()
-                LIMIT %s
-            ),
-            mvtgeom AS (
-                SELECT ST_AsMVTGeom(
-                        geom_3857,
-                        ST_Transform(ST_TileEnvelope(%s, %s, %s), 3857),
-                        4096, 0, true
-                    ) AS geom, rok_wykonania
-                FROM limited
-            )
-            SELECT ST_AsMVT(mvtgeom.*, 'layer', 4096, 'geom') AS tile
-            FROM mvtgeom;
-            """
-            params = (z, x, y, max_clusters, z, x, y)
+    def build_cluster_pyramid(self, zoom_min: int = 0, zoom_max: int = tiles_max_zoom - 1) -> None:
+        """Przelicza piramidę klastrów w jednej transakcji (czytelnicy widzą starą do zatwierdzenia)"""
+        print(f"Building cluster pyramid for zoom {zoom_min}-{zoom_max}...")
+        with self.conn.cursor() as cur:
+            for sql in cluster_pyramid_queries(zoom_min, zoom_max, self.table_name, self.geom_column):
+                cur.execute(sql)
+        self.conn.commit()
+
+    def get_tile(self, z: int, x: int, y: int) -> tuple[bytes | None, int]:
+        """
+        Generuje kafel MVT z piramidy klastrów, DBSCAN lub pełnych danych.
+        Zwraca (kafel albo None, n), gdzie n > 0 oznacza, że kafel zawiera punkty:
+        dla DBSCAN to wynik count_query (limit klastrów może dać pusty kafel mimo
+        punktów), w pozostałych trybach liczba obiektów zwrócona razem z kaflem
+        w jednym zapytaniu.
+        """
+        n = None
+        if needs_count(z):
+            n = self.count_features_in_tile(z, x, y)
+            if n == 0:
+                return None, 0
+
+        sql, params = tile_query(z, x, y, n, self.table_name, self.geom_column)
 
         with self.conn.cursor() as cur:
             cur.execute(sql, params)
             result = cur.fetchone()
-            if result and result[0]:
-                print(f"Generated tile z={z}, x={x}, y={y}, n={n}, mode={'FULL' if z>=tiles_max_zoom else 'CLUSTER'}")
-                return result[0]
-            else:
-                return None
+        features = result[1] if result else 0
+        if n is None:
+            n = features
+        if result and result[0] and features:
+            print(f"Generated tile z={z}, x={x}, y={y}, n={n}, mode={'FULL' if z>=tiles_max_zoom else tiles_clustering.upper()}")
+            return result[0], n
+        return None, n
+
+    @staticmethod
+    def tile_range(
+        extent: tuple[float, float, float, float],
+        z: int
+    ) -> tuple[int, int, int, int]:
+        """Zakres kafli (x_min, x_max, y_min, y_max) pokrywających extent na danym zoomie"""
+        minx, miny, maxx, maxy = extent
+        ul_tile = mercantile.tile(minx, maxy, z)
+        lr_tile = mercantile.tile(maxx, miny, z)
+        return ul_tile.x, lr_tile.x, ul_tile.y, lr_tile.y
+
+    def iter_tiles(
+        self,
+        zoom_min: int = 0,
+        zoom_max: int = 14,
+        workers: int = 1
+    ) -> Iterator[tuple[int, int, int, bytes]]:
+        """
+        Generuje kafle MVT extentu danych, zwracając je w miarę powstawania.
+        Kafle przechodzone są drzewem czwórkowym poziom po poziomie: dzieci
+        (w obrębie extentu) odwiedzane są tylko dla kafli zawierających punkty, bo
+        kafel bez punktów ma puste całe poddrzewo (morze, sąsiednie kraje). Przy workers > 1
+        kafle poziomu renderowane są równolegle w osobnych procesach, każdy z własnym
+        połączeniem do bazy; kolejność kafli w obrębie poziomu jest wtedy dowolna.
+        """
+        extent = self.get_extent()
+        x_min, x_max, y_min, y_max = self.tile_range(extent, zoom_min)
+        level = [(zoom_min, x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+        with self.tile_renderer(workers) as render:
+            while level:
+                zoom = level[0][0]
+                children = []
+                if zoom < zoom_max:
+                    x_min, x_max, y_min, y_max = self.tile_range(extent, zoom + 1)
+                skipped = 0
+                for z, x, y, tile_bytes, n in render(level):
+                    if tile_bytes:
+                        yield z, x, y, tile_bytes
+                    if n == 0:
+                        skipped += 1
+                        continue
+                    if z < zoom_max:
+                        children.extend(
+                            (z + 1, cx, cy)
+                            for cx in (2 * x, 2 * x + 1)
+                            for cy in (2 * y, 2 * y + 1)
+                            if x_min <= cx <= x_max and y_min <= cy <= y_max
+                        )
+                print(f"Zoom {zoom}: {len(level) - skipped} with data, {skipped} empty (subtrees skipped)")
+                level = sorted(children)
+
+    @contextmanager
+    def tile_renderer(self, workers: int = 1, chunk_size: int = 50) -> Iterator:
+        """
+        Zwraca funkcję renderującą listę kafli (z, x, y) -> (z, x, y, bajty albo None, n).
+        Przy workers > 1 lista dzielona jest na paczki po co najwyżej chunk_size kafli
+        dla ProcessPoolExecutor, a w każdym procesie działa własny MVTGenerator
+        z osobnym połączeniem do bazy; pula żyje przez cały blok with.
+        """
+        if workers <= 1:
+            yield self.render_tile_list
+            return
 
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=(self.db_config, self.table_name, self.geom_column)
+        ) as executor:
+            def render(tiles: list[tuple[int, int, int]]) -> Iterator[tuple[int, int, int, bytes | None, int]]:
+                # kilka paczek na proces, żeby wyrównać obciążenie
+                size = max(1, min(chunk_size, math.ceil(len(tiles) / (workers * 4))))
+                futures = [
+                    executor.submit(call_worker, "render_tile_list", tiles[i:i + size])
+                    for i in range(0, len(tiles), size)
+                ]
+                for future in as_completed(futures):
+                    yield from future.result()
+
+            yield render
+
+    def render_tile_list(self, tiles: list[tuple[int, int, int]]) -> list[tuple[int, int, int, bytes | None, int]]:
+        """Renderuje podane kafle; kafle bez danych zwraca z None (n jak w get_tile)"""
+        rendered = []
+        for z, x, y in tiles:
+            tile_bytes, n = self.get_tile(z, x, y)
+            rendered.append((z, x, y, bytes(tile_bytes) if tile_bytes else None, n))
+        return rendered
+
+    @staticmethod
+    def affected_tiles(
+        changed_tiles: set[tuple[int, int]],
+        changed_zoom: int,
+        zoom_min: int,
+        zoom_max: int
+    ) -> list[tuple[int, int, int]]:
+        """
+        Kafle (z, x, y) do przegenerowania: zmienione kafle z `changed_zoom`
+        przeniesione na każdy zoom z zakresu, czyli wraz z przodkami.
+        """
+        if changed_zoom < zoom_max:
+            raise ValueError(f"Changed tiles at zoom {changed_zoom} do not cover zoom {zoom_max}")
+        tiles = set()
+        for z in range(zoom_min, zoom_max + 1):
+            shift = changed_zoom - z
+            tiles.update((z, x >> shift, y >> shift) for x, y in changed_tiles)
+        return sorted(tiles, reverse=True)
+
+    def update_tiles(
+        self,
+        writer,
+        changed_tiles: set[tuple[int, int]],
+        changed_zoom: int,
+        zoom_min: int = 0,
+        zoom_max: int = 14,
+        workers: int = 1,
+        chunk_size: int = 50
+    ) -> int:
+        """
+        Przegenerowuje tylko kafle obejmujące zmienione obszary (i ich przodków),
+        zapisując je do writera; kafle, które straciły wszystkie dane, są usuwane.
+        Zwraca liczbę przegenerowanych kafli.
+        """
+        tiles = self.affected_tiles(changed_tiles, changed_zoom, zoom_min, zoom_max)
+        print(f"Regenerating {len(tiles)} tiles touched by {len(changed_tiles)} changed tiles at zoom {changed_zoom}")
+        with self.tile_renderer(workers, chunk_size) as render:
+            for z, x, y, tile_bytes, _ in render(tiles):
+                if tile_bytes:
+                    writer.put(z, x, y, tile_bytes)
+                else:
+                    writer.delete(z, x, y)
+        return len(tiles)
 
     def generate_tiles_for_extent(self, zoom_min: int = 0, zoom_max: int = 14) -> list[tuple[int, int, int, bytes]]:
         """Generuje kafle MVT tylko dla extentu danych"""
-        minx, miny, maxx, maxy = self.get_extent()
-        tiles = []
+        return list(self.iter_tiles(zoom_min, zoom_max))
 
-        for z in range(zoom_min, zoom_max + 1):
-            ul_tile = mercantile.tile(minx, maxy, z)
-            lr_tile = mercantile.tile(maxx, miny, z)
+    def write_tiles(self, writer, zoom_min: int = 0, zoom_max: int = 14, workers: int = 1) -> int:
+        """Zapisuje kafle extentu danych do writera (katalog albo MBTiles), zwraca ich liczbę"""
+        tile_count = 0
+        for z, x, y, tile_bytes in self.iter_tiles(zoom_min, zoom_max, workers):
+            writer.put(z, x, y, tile_bytes)
+            tile_count += 1
+            if tile_count % 100 == 0:
+                print(f"Generated {tile_count} tiles...")
+        return tile_count
 
-            for x in range(ul_tile.x, lr_tile.x + 1):
-                for y in range(ul_tile.y, lr_tile.y + 1):
-                    tile_bytes = self.get_tile(z, x, y)
-                    if tile_bytes:
-                        tiles.append((z, x, y, tile_bytes))
-        return tiles
+
+# Generator procesu roboczego (ProcessPoolExecutor), z własnym połączeniem do bazy.
+worker_generator: MVTGenerator | None = None
+
+
+def init_worker(db_config: dict, table_name: str, geom_column: str) -> None:
+    global worker_generator
+    worker_generator = MVTGenerator(db_config, table_name, geom_column)
+
+
+def call_worker(method: str, partition) -> list:
+    return getattr(worker_generator, method)(partition)
+
+
+def mbtiles_metadata(bounds: tuple[float, float, float, float] | None = None) -> dict:
+    """
+    Metadane MBTiles 1.3 dla kafli z tile_query: zakres zoomów, bounds extentu
+    danych i wymagany dla format=pbf wiersz json z opisem warstwy (vector_layers).
+    """
+    metadata = {
+        "minzoom": str(tiles_min_zoom),
+        "maxzoom": str(tiles_max_zoom),
+        "json": json.dumps({
+            "vector_layers": [{
+                "id": "layer",
+                "fields": {
+                    "id": "Number",
+                    "rok_wykonania": "Number",
+                    "point_count": "Number"
+                },
+                "minzoom": tiles_min_zoom,
+                "maxzoom": tiles_max_zoom
+            }]
+        })
+    }
+    if bounds:
+        metadata["bounds"] = ",".join(str(value) for value in bounds)
+    return metadata
+
+
+def tile_writer(
+    output_dir: str = tiles_output_dir,
+    format: str = tiles_format,
+    update: bool = False,
+    bounds: tuple[float, float, float, float] | None = None
+):
+    if format == "mbtiles":
+        return MBTilesWriter(
+            os.path.join(output_dir, mbtiles_name),
+            metadata=mbtiles_metadata(bounds),
+            update=update
+        )
+    return DirectoryTileWriter(output_dir)
 
 
 if __name__ == "__main__":
@@ -265,16 +563,10 @@ if __name__ == "__main__":
         geom_column="geometry"
     )
     
-    tiles = generator.generate_tiles_for_extent(
-        zoom_min=tiles_min_zoom,
-        zoom_max=tiles_max_zoom
-    )
+    if tiles_clustering == "grid":
+        generator.build_cluster_pyramid()
+    writer = tile_writer(bounds=generator.get_extent())
+    generator.write_tiles(writer, zoom_min=tiles_min_zoom, zoom_max=tiles_max_zoom, workers=tiles_workers)
+    writer.close()
 
-    for z, x, y, tile_bytes in tiles:
-        folder = f"{tiles_output_dir}/{z}/{x}"
-        os.makedirs(folder, exist_ok=True)
-        filename = f"{folder}/{y}.pbf"
-        with open(filename, "wb") as f:
-            f.write(tile_bytes)
-    
     generator.save_stats(f"{tiles_output_dir}/stats.json")
\ No newline at end of file
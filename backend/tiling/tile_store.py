@@ -0,0 +1,150 @@
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+from uuid import uuid4
+
+# Format zapisu kafli: "directory" ({z}/{x}/{y}.pbf) albo "mbtiles" (jeden plik SQLite).
+tiles_format = os.getenv("TILES_FORMAT", "directory")
+mbtiles_name = os.getenv("MBTILES_NAME", "tiles.mbtiles")
+
+
+def write_file_atomic(path: Path, data: bytes) -> None:
+    """Zapis przez plik tymczasowy i os.replace, żeby nie serwować niedopisanego pliku."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{uuid4().hex}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+class DirectoryTileWriter:
+    """Zapis kafli jako osobnych plików {z}/{x}/{y}.pbf."""
+    def __init__(self, tiles_dir: str | Path):
+        self.tiles_dir = Path(tiles_dir)
+
+    def put(self, z: int, x: int, y: int, tile_bytes: bytes) -> None:
+        # atomowo, bo update_tiles podmienia kafle serwowane w tym czasie przez API
+        write_file_atomic(self.tiles_dir / str(z) / str(x) / f"{y}.pbf", bytes(tile_bytes))
+
+    def delete(self, z: int, x: int, y: int) -> None:
+        (self.tiles_dir / str(z) / str(x) / f"{y}.pbf").unlink(missing_ok=True)
+
+    def close(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        pass
+
+
+class MBTilesWriter:
+    """
+    Zapis kafli do archiwum MBTiles (SQLite, schemat MBTiles 1.3, wiersze w układzie TMS).
+    Archiwum powstaje w pliku tymczasowym i dopiero close() podmienia docelowy
+    plik przez os.replace, więc czytelnicy widzą zawsze kompletny zestaw kafli.
+    Przy update=True plik tymczasowy startuje jako kopia istniejącego archiwum
+    i zmieniane są tylko zapisane / usunięte kafle oraz podane metadane.
+    """
+    def __init__(
+        self,
+        path: str | Path,
+        metadata: dict | None = None,
+        batch_size: int = 1000,
+        update: bool = False
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = self.path.with_name(f".{self.path.name}.{uuid4().hex}.tmp")
+        self.batch_size = batch_size
+        self.pending: list[tuple] = []
+        if update:
+            shutil.copyfile(self.path, self.tmp_path)
+        self.conn = sqlite3.connect(self.tmp_path)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        if not update:
+            self.conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+            self.conn.execute("""
+                CREATE TABLE tiles (
+                    zoom_level INTEGER,
+                    tile_column INTEGER,
+                    tile_row INTEGER,
+                    tile_data BLOB
+                )
+            """)
+            metadata = {"name": self.path.stem, "format": "pbf", **(metadata or {})}
+        self.set_metadata(metadata or {})
+
+    def set_metadata(self, metadata: dict) -> None:
+        """Zapisuje (albo podmienia) wiersze tabeli metadata"""
+        self.conn.executemany("DELETE FROM metadata WHERE name = ?", [(name,) for name in metadata])
+        self.conn.executemany("INSERT INTO metadata (name, value) VALUES (?, ?)", metadata.items())
+
+    def put(self, z: int, x: int, y: int, tile_bytes: bytes) -> None:
+        self.pending.append((z, x, (1 << z) - 1 - y, bytes(tile_bytes)))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def delete(self, z: int, x: int, y: int) -> None:
+        self.flush()
+        self.conn.execute(
+            "DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y)
+        )
+
+    def flush(self) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+            self.pending
+        )
+        self.pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self.conn.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+class MBTilesReader:
+    """
+    Odczyt kafli z archiwum MBTiles przez jedno otwarte połączenie tylko do odczytu.
+    Po podmianie pliku (inny inode / mtime) połączenie jest otwierane ponownie.
+    """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.conn: sqlite3.Connection | None = None
+        self.identity: tuple | None = None
+
+    def current(self) -> tuple | None:
+        """(inode, mtime_ns) otwartego archiwum albo None, gdy archiwum nie istnieje."""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            self.close()
+            return None
+        identity = (stat.st_ino, stat.st_mtime_ns)
+        if identity != self.identity:
+            self.close()
+            self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self.identity = identity
+        return self.identity
+
+    def get(self, z: int, x: int, y: int) -> bytes | None:
+        if self.current() is None:
+            return None
+        row = self.conn.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y)
+        ).fetchone()
+        return row[0] if row else None
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            self.identity = None
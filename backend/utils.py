@@ -1,3 +1,5 @@
+import base64
+import json
 import math
 
 
@@ -11,4 +13,22 @@ def sanitize_json(obj: object) -> object | None:
             return None
         return obj
     else:
-        return obj
\ No newline at end of file
+        return obj
+
+
+def encode_cursor(last_id: int) -> str:
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> int:
+    """
+    Zwraca ostatnie widziane id zakodowane w tokenie stronicowania (0 dla pierwszej strony).
+    """
+    if not cursor:
+        return 0
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(payload)["id"])
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
@@ -36,10 +36,29 @@ function App() {
   const [isTileMode, setIsTileMode] = useState(true);
   const [metadata, setMetadata] = useState(null);
   
-  const requestParams = useMemo(
-    () => ({ limit: FETCH_LIMIT, polygon }),
-    [polygon]
-  );
+  const regionGeometry = useRegionGeometry(region.level, region.kod, region.nazwa, region.area);
+
+  // Geometrie pobranych regionów -> { level, kod }, z którego kodu pochodzą. Poligon
+  // przekazany z mapy jest regionem tylko wtedy, gdy to dokładnie ta geometria.
+  const regionPolygons = useRef(new WeakMap());
+  const loadedRegionPolygon = extractGeometryFromRegion(regionGeometry);
+  const loadedRegionProperties = regionGeometry?.features?.[0]?.properties;
+  if (loadedRegionPolygon && loadedRegionProperties?.kod && !regionPolygons.current.has(loadedRegionPolygon)) {
+    regionPolygons.current.set(loadedRegionPolygon, {
+      level: loadedRegionProperties.level,
+      kod: loadedRegionProperties.kod
+    });
+  }
+
+  const polygonRegion = polygon ? regionPolygons.current.get(polygon) : undefined;
+  const polygonRegionLevel = polygonRegion?.level;
+  const polygonRegionKod = polygonRegion?.kod;
+
+  const requestParams = useMemo(() => {
+    return polygonRegionKod
+      ? { limit: FETCH_LIMIT, region: { level: polygonRegionLevel, kod: polygonRegionKod } }
+      : { limit: FETCH_LIMIT, polygon };
+  }, [polygon, polygonRegionLevel, polygonRegionKod]);
 
   const { features, loading } = useFetchPointsData(requestParams); 
   const [yearRange, setYearRange] = useState(DEFAULT_YEAR_RANGE);
@@ -140,8 +159,6 @@ function App() {
   }, [loading, baseFeatures.length, absoluteMinYear, absoluteMaxYear]);
 
 
-  const regionGeometry = useRegionGeometry(region.level, region.kod, region.nazwa, region.area);
-
   const polygonArea = useMemo(() => {
     if (region?.level && region?.kod && region?.area) {
       return region.area;
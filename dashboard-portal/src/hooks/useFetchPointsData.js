@@ -1,25 +1,36 @@
 import { useState, useEffect, useRef, useMemo } from 'react';
 
-export function useFetchPointsData({ limit = 500_000, polygon = null }) {
+const fetchPage = ({ polygon, region, cursor, limit, signal }) => {
+  if (region) {
+    const params = new URLSearchParams({ level: region.level, jpt_kod: region.kod, limit });
+    if (cursor) params.set('cursor', cursor);
+    return fetch(`http://localhost:8000/api/zdjecia/region?${params}`, { signal });
+  }
+  return fetch('http://localhost:8000/api/zdjecia/filter', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ polygon, cursor, limit }),
+    signal
+  });
+};
+
+export function useFetchPointsData({ limit = 500_000, polygon = null, region = null }) {
   const [features, setFeatures] = useState([]);
   const [loading, setLoading] = useState(true);
-  const skip = useRef(0);
+  const cursor = useRef(null);
 
   useEffect(() => {
     let isCancelled = false;
+    const controller = new AbortController();
     setLoading(true);
     setFeatures([]);
-    skip.current = 0;
+    cursor.current = null;
 
     const fetchData = async () => {
       try {
-        if (polygon) {
+        if (polygon || region) {
           const recursiveFetchPoly = async () => {
-            const response = await fetch('http://localhost:8000/api/zdjecia/filter', {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({ polygon, skip: skip.current, limit })
-            });
+            const response = await fetchPage({ polygon, region, cursor: cursor.current, limit, signal: controller.signal });
             if (!response.ok) {
               console.error('Server error', response.status);
               setLoading(false);
@@ -35,7 +46,11 @@ export function useFetchPointsData({ limit = 500_000, polygon = null }) {
               const next = [...prev, ...data.features];
               return JSON.stringify(prev) === JSON.stringify(next) ? prev : next;
             });
-            skip.current += limit;
+            if (!data.next) {
+              setLoading(false);
+              return;
+            }
+            cursor.current = data.next;
             await recursiveFetchPoly();
           };
           await recursiveFetchPoly();
@@ -44,14 +59,18 @@ export function useFetchPointsData({ limit = 500_000, polygon = null }) {
           setLoading(false);
         }
       } catch (err) {
+        if (isCancelled) return;
         console.error('Fetch error', err);
         setLoading(false);
       }
     };
 
     fetchData();
-    return () => { isCancelled = true; };
-  }, [limit, polygon]);
+    return () => {
+      isCancelled = true;
+      controller.abort();
+    };
+  }, [limit, polygon, region]);
 
   return useMemo(() => ({ features, loading }), [features, loading]);
 }
\ No newline at end of file